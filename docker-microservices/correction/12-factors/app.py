@@ -1,37 +1,71 @@
 # app.py - Version utilisant database.py
+import hmac
 import os
 import sys
 import logging
 import signal
-from flask import Flask, jsonify, request
+from flask import Flask, g, jsonify, request
+from werkzeug.middleware.proxy_fix import ProxyFix
 from config import Config
-from database import DatabaseManager
+from database import DatabaseManager, TemporarilyUnavailableError
 from models import User
+from ratelimit import RateLimiter
+from compression import Compressor
+from health import HealthMonitor
+from idempotency import Idempotency, create_store
+from profiling import SamplingProfiler, SlowRequestLog, timed
+from request_log import RequestLogger, set_rows, setup_logging
 
-# Configuration du logging
+# Configuration du logging : écriture sur stdout par un thread dédié
 config = Config()
-logging.basicConfig(
-    level=getattr(logging, config.LOG_LEVEL.upper()),
-    format=config.LOG_FORMAT,
-    handlers=[logging.StreamHandler(sys.stdout)]
-)
+setup_logging(config)
 
 logger = logging.getLogger(__name__)
 
 # Initialisation de l'application
 app = Flask(__name__)
 app.config['SECRET_KEY'] = config.SECRET_KEY
+if config.TRUSTED_PROXY_HOPS:
+    # Derrière un proxy de confiance : remote_addr devient le client vu par ce proxy
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=config.TRUSTED_PROXY_HOPS)
 
 # Initialisation de la base de données
 logger.info(f"Initializing database with URL: {config.DATABASE_URL}")
 db_manager = DatabaseManager(config)
 
+# Une ligne de log par requête, échantillonnée. Enregistré avant le limiteur :
+# les requêtes refusées (429/503) par son before_request sont aussi journalisées
+request_logger = RequestLogger(config)
+request_logger.init_app(app)
+
+# Limitation de débit et délestage en cas de surcharge
+rate_limiter = RateLimiter(config, db_manager)
+rate_limiter.init_app(app)
+
+# Compression des réponses selon Accept-Encoding
+compressor = Compressor(config)
+compressor.init_app(app)
+
+# Instrumentation : profilage à la demande et journal des requêtes lentes
+profiler = SamplingProfiler()
+slow_requests = SlowRequestLog(config)
+slow_requests.init_app(app)
+
+# Surveillance de la base en tâche de fond : les sondes lisent l'état en cache
+health_monitor = HealthMonitor(config, db_manager)
+health_monitor.init_app(app)
+health_monitor.start()
+
+# Déduplication des écritures rejouées (en-tête Idempotency-Key)
+idempotency = Idempotency(config, create_store(config, db_manager))
+
 # Initialisation au démarrage de l'application
 def initialize_app():
     """Initialiser l'application au démarrage"""
     logger.info("Initializing application...")
     try:
         db_manager.init_tables()
+        idempotency.store.init_tables()
         logger.info("Application initialized successfully")
     except Exception as e:
         logger.error(f"Failed to initialize application: {e}")
@@ -45,43 +79,62 @@ def signal_handler(signum, frame):
 signal.signal(signal.SIGTERM, signal_handler)
 signal.signal(signal.SIGINT, signal_handler)
 
+def unavailable(error):
+    """Erreur passagère (pool épuisé...) : 503 avec Retry-After plutôt qu'une erreur 500"""
+    logger.warning(f"Temporarily unavailable: {error}")
+    # Délestage, comme les 503 du RateLimiter : exclu du taux d'erreur de /ready
+    g.load_shed = True
+    response = jsonify({"error": f"Service temporarily unavailable: {error}"})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
 @app.route('/health', methods=['GET'])
 def health():
-    """Health check endpoint"""
-    try:
-        db_healthy = db_manager.health_check()
-        status = "healthy" if db_healthy else "unhealthy"
-        status_code = 200 if db_healthy else 503
-        
-        return jsonify({
-            "status": status,
-            "database": "connected" if db_healthy else "disconnected",
-            "version": "1.0.0",
-            "database_url": config.DATABASE_URL.split('@')[1] if '@' in config.DATABASE_URL else config.DATABASE_URL
-        }), status_code
-    except Exception as e:
-        logger.error(f"Health check failed: {e}")
-        return jsonify({
-            "status": "unhealthy",
-            "error": str(e)
-        }), 503
+    """Liveness : servi depuis l'état en cache, sans connexion à la base"""
+    alive = health_monitor.is_alive()
+    state = health_monitor.snapshot()
+    return jsonify({
+        "status": ("healthy" if state["database"] == "connected" else "degraded") if alive else "unhealthy",
+        "database": state["database"],
+        "version": "1.0.0",
+        "database_url": config.DATABASE_URL.split('@')[1] if '@' in config.DATABASE_URL else config.DATABASE_URL
+    }), 200 if alive else 503
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness : retire l'instance du trafic si la base ou le pool sont en difficulté"""
+    reasons = health_monitor.not_ready_reasons()
+    body = health_monitor.snapshot()
+    body["status"] = "not ready" if reasons else "ready"
+    if reasons:
+        body["reasons"] = reasons
+    return jsonify(body), 503 if reasons else 200
 
 @app.route('/users', methods=['GET'])
 def get_users():
-    """Récupérer tous les utilisateurs"""
+    """Récupérer les utilisateurs (?limit=N pour les N plus récents), ou une sélection via ?ids=1,2,3"""
+    if request.args.get('ids') is not None:
+        return batch_get_users(request.args['ids'].split(','))
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 0:
+        return jsonify({"error": "limit must not be negative"}), 400
     try:
-        logger.info("Getting all users from database")
-        users = db_manager.get_users()
-        logger.info(f"Retrieved {len(users)} users from database")
-        return jsonify({
-            "users": [user.to_dict() for user in users],
-            "count": len(users)
-        })
+        users = db_manager.get_users(limit)
+        set_rows(len(users))
+        with timed('serialization'):
+            return jsonify({
+                "users": [user.to_dict() for user in users],
+                "count": len(users)
+            })
+    except TemporarilyUnavailableError as e:
+        return unavailable(e)
     except Exception as e:
         logger.error(f"Failed to get users: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
 @app.route('/users', methods=['POST'])
+@idempotency.idempotent
 def create_user():
     """Créer un nouvel utilisateur"""
     try:
@@ -90,13 +143,15 @@ def create_user():
         if not data or not data.get('name') or not data.get('email'):
             return jsonify({"error": "name and email are required"}), 400
         
-        logger.info(f"Creating user: {data['name']}")
+        logger.debug("Creating user: %s", data['name'])
         user = User(name=data['name'], email=data['email'])
         created_user = db_manager.create_user(user)
         
-        logger.info(f"Created user: {created_user.name} with ID: {created_user.id}")
+        logger.debug("Created user: %s with ID: %s", created_user.name, created_user.id)
         return jsonify(created_user.to_dict()), 201
         
+    except TemporarilyUnavailableError as e:
+        return unavailable(e)
     except Exception as e:
         logger.error(f"Failed to create user: {e}")
         # Vérifier si c'est une erreur de contrainte d'unicité
@@ -104,21 +159,69 @@ def create_user():
             return jsonify({"error": "name or email already exists"}), 409
         return jsonify({"error": "Internal server error"}), 500
 
+@app.route('/users/batch-get', methods=['POST'])
+def batch_get_users_route():
+    """Récupérer plusieurs utilisateurs : {"ids": [1, 2, 3]}"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "body must be a JSON object"}), 400
+    if not isinstance(data.get('ids'), list):
+        return jsonify({"error": "ids must be a list"}), 400
+    return batch_get_users(data['ids'])
+
+def parse_user_id(value):
+    """ID entier JSON (pas un booléen ni un flottant) ou chaîne de chiffres de la query string"""
+    if isinstance(value, bool):
+        raise ValueError(value)
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value.strip())
+    raise ValueError(value)
+
+def batch_get_users(raw_ids):
+    """Lecture groupée : une seule requête SQL pour N utilisateurs"""
+    try:
+        user_ids = [parse_user_id(user_id) for user_id in raw_ids if str(user_id).strip() != '']
+    except ValueError:
+        return jsonify({"error": "ids must be integers"}), 400
+    if not user_ids:
+        return jsonify({"error": "at least one id is required"}), 400
+    if len(user_ids) > config.BATCH_MAX_IDS:
+        return jsonify({"error": f"at most {config.BATCH_MAX_IDS} ids per request"}), 400
+    
+    try:
+        users, missing = db_manager.get_users_by_ids(user_ids)
+        set_rows(len(users))
+        with timed('serialization'):
+            return jsonify({
+                "users": [user.to_dict() for user in users],
+                "count": len(users),
+                "missing": missing
+            })
+    except TemporarilyUnavailableError as e:
+        return unavailable(e)
+    except Exception as e:
+        logger.error(f"Failed to batch get users: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
 @app.route('/users/<int:user_id>', methods=['GET'])
 def get_user(user_id):
     """Récupérer un utilisateur par ID"""
     try:
-        logger.info(f"Getting user with ID: {user_id}")
         user = db_manager.get_user_by_id(user_id)
         if not user:
             return jsonify({"error": "User not found"}), 404
         
         return jsonify(user.to_dict())
+    except TemporarilyUnavailableError as e:
+        return unavailable(e)
     except Exception as e:
         logger.error(f"Failed to get user {user_id}: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
 @app.route('/users/<int:user_id>', methods=['PUT'])
+@idempotency.idempotent
 def update_user(user_id):
     """Mettre à jour un utilisateur"""
     try:
@@ -127,16 +230,17 @@ def update_user(user_id):
         if not data or not data.get('name') or not data.get('email'):
             return jsonify({"error": "name and email are required"}), 400
         
-        logger.info(f"Updating user with ID: {user_id}")
         user = User(name=data['name'], email=data['email'])
         updated_user = db_manager.update_user(user_id, user)
         
         if not updated_user:
             return jsonify({"error": "User not found"}), 404
         
-        logger.info(f"Updated user: {updated_user.name}")
+        logger.debug("Updated user: %s", updated_user.name)
         return jsonify(updated_user.to_dict())
         
+    except TemporarilyUnavailableError as e:
+        return unavailable(e)
     except Exception as e:
         logger.error(f"Failed to update user {user_id}: {e}")
         # Vérifier si c'est une erreur de contrainte d'unicité
@@ -148,15 +252,16 @@ def update_user(user_id):
 def delete_user(user_id):
     """Supprimer un utilisateur"""
     try:
-        logger.info(f"Deleting user with ID: {user_id}")
         deleted = db_manager.delete_user(user_id)
         
         if not deleted:
             return jsonify({"error": "User not found"}), 404
         
-        logger.info(f"Deleted user with ID: {user_id}")
+        logger.debug("Deleted user with ID: %s", user_id)
         return '', 204
         
+    except TemporarilyUnavailableError as e:
+        return unavailable(e)
     except Exception as e:
         logger.error(f"Failed to delete user {user_id}: {e}")
         return jsonify({"error": "Internal server error"}), 500
@@ -170,7 +275,49 @@ def debug_info():
         "log_level": config.LOG_LEVEL,
         "port": config.PORT,
         "host": config.HOST,
-        "flask_env": config.FLASK_ENV
+        "flask_env": config.FLASK_ENV,
+        "rate_limiter": rate_limiter.stats(),
+        "database_pool": db_manager.pool_stats()
+    })
+
+# Sans DEBUG_TOKEN, les routes de profilage ne répondent qu'en local (docker exec, port-forward)
+LOOPBACK_ADDRESSES = {'127.0.0.1', '::1'}
+
+def debug_allowed():
+    """Les routes de profilage exigent le jeton DEBUG_TOKEN, ou une requête locale"""
+    if config.DEBUG_TOKEN:
+        return hmac.compare_digest(request.headers.get('X-Debug-Token', ''), config.DEBUG_TOKEN)
+    return request.remote_addr in LOOPBACK_ADDRESSES
+
+@app.route('/debug/profile', methods=['GET'])
+def debug_profile():
+    """Profil par échantillonnage de tous les threads, au format "piles repliées" """
+    if not debug_allowed():
+        return jsonify({"error": "Forbidden"}), 403
+    try:
+        seconds = float(request.args.get('seconds', 5))
+    except ValueError:
+        return jsonify({"error": "seconds must be a number"}), 400
+    if not 0 < seconds <= config.PROFILE_MAX_SECONDS:
+        return jsonify({"error": f"seconds must be between 0 and {config.PROFILE_MAX_SECONDS}"}), 400
+    
+    try:
+        samples = profiler.profile(seconds)
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 409
+    
+    logger.info(f"Profiled {seconds}s: {sum(samples.values())} samples")
+    return SamplingProfiler.to_collapsed(samples), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+@app.route('/debug/slow', methods=['GET'])
+def debug_slow():
+    """Requêtes récentes les plus lentes avec le détail de leurs phases"""
+    if not debug_allowed():
+        return jsonify({"error": "Forbidden"}), 403
+    limit = request.args.get('limit', type=int)
+    return jsonify({
+        "threshold_ms": config.SLOW_REQUEST_MS,
+        "requests": slow_requests.slowest(limit)
     })
 
 @app.errorhandler(404)
@@ -0,0 +1,144 @@
+# compression.py - Compression des réponses négociée via Accept-Encoding
+import logging
+import zlib
+from flask import request
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Encodages optionnels : utilisés seulement si la bibliothèque est installée
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'text/html',
+    'text/plain',
+    'text/css',
+    'application/javascript'
+}
+
+
+class _GzipStream:
+    def __init__(self, level):
+        self.obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, chunk):
+        return self.obj.compress(chunk)
+
+    def flush(self):
+        return self.obj.flush()
+
+
+class _BrotliStream:
+    def __init__(self, level):
+        self.obj = brotli.Compressor(quality=min(level, 11))
+
+    def compress(self, chunk):
+        return self.obj.process(chunk)
+
+    def flush(self):
+        return self.obj.finish()
+
+
+class _ZstdStream:
+    def __init__(self, level):
+        self.obj = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, chunk):
+        return self.obj.compress(chunk)
+
+    def flush(self):
+        return self.obj.flush()
+
+
+class Compressor:
+    """Middleware Flask de compression des réponses (bufferisées ou en flux)"""
+
+    def __init__(self, config: Config):
+        self.enabled = config.COMPRESSION_ENABLED
+        self.min_size = config.COMPRESSION_MIN_SIZE
+        self.level = config.COMPRESSION_LEVEL
+        # Ordre de préférence du serveur à qualité égale
+        self.encoders = {}
+        if zstandard is not None:
+            self.encoders['zstd'] = _ZstdStream
+        if brotli is not None:
+            self.encoders['br'] = _BrotliStream
+        self.encoders['gzip'] = _GzipStream
+        logger.info("Response compression: %s", ', '.join(self.encoders) if self.enabled else 'disabled')
+
+    def init_app(self, app):
+        app.after_request(self._after_request)
+
+    def choose_encoding(self, accept_encoding):
+        """Choisir le meilleur encodage supporté selon l'en-tête Accept-Encoding"""
+        accepted = {}
+        for part in (accept_encoding or '').split(','):
+            fields = part.strip().split(';')
+            name = fields[0].strip().lower()
+            if not name:
+                continue
+            quality = 1.0
+            for param in fields[1:]:
+                key, _, value = param.strip().partition('=')
+                if key == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            accepted[name] = quality
+
+        best, best_quality = None, 0.0
+        for encoding in self.encoders:
+            quality = accepted.get(encoding, accepted.get('*', 0.0))
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def compress(self, data: bytes, encoding: str) -> bytes:
+        stream = self.encoders[encoding](self.level)
+        return stream.compress(data) + stream.flush()
+
+    def _compress_stream(self, chunks, encoding):
+        stream = self.encoders[encoding](self.level)
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            compressed = stream.compress(chunk)
+            if compressed:
+                yield compressed
+        yield stream.flush()
+
+    def _after_request(self, response):
+        if not self.enabled:
+            return response
+        if (response.status_code < 200 or response.status_code in (204, 304)
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = self.choose_encoding(request.headers.get('Accept-Encoding'))
+        if not encoding:
+            return response
+
+        if response.is_streamed:
+            # Réponse en flux : on compresse au fil de l'eau, sans bufferiser
+            response.response = self._compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            response.set_data(self.compress(data, encoding))
+
+        response.headers['Content-Encoding'] = encoding
+        return response
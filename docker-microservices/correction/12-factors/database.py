@@ -3,37 +3,107 @@ import psycopg2
 import psycopg2.pool
 from psycopg2.extras import RealDictCursor
 import logging
-from typing import List, Optional
+import threading
+import time
+from typing import List, Optional, Tuple
 from models import User
 from config import Config
+from profiling import record_phase
+from storage import MemoryEngine, SQLiteEngine, StorageEngine
 
 logger = logging.getLogger(__name__)
 
-class DatabaseManager:
-    def __init__(self, config: Config):
+class TemporarilyUnavailableError(Exception):
+    """Erreur passagère : l'API répond 503 avec Retry-After au lieu de 500"""
+
+    retry_after = 1
+
+class PoolTimeoutError(TemporarilyUnavailableError):
+    """Aucune connexion libérée dans le délai DB_POOL_TIMEOUT"""
+
+class PostgresEngine(StorageEngine):
+    """Moteur PostgreSQL (production) avec pool de connexions psycopg2"""
+
+    name = "postgres"
+
+    def __init__(self, config: Config, dsn: Optional[str] = None):
         self.config = config
+        self.dsn = dsn or config.DATABASE_URL
         self.pool = None
+        # Le pool psycopg2 n'attend jamais (PoolError s'il est épuisé) :
+        # le sémaphore fait patienter les requêtes, avec un délai maximum
+        self.slots = threading.BoundedSemaphore(config.DB_POOL_MAX_CONN)
+        # Statistiques du pool, utilisées pour le délestage
+        self.stats_lock = threading.Lock()
+        self.connections_in_use = 0
+        self.waiting = 0
+        self.avg_wait_ms = 0.0
+        self.checkout_times = {}
         self._init_pool()
     
     def _init_pool(self):
         try:
-            logger.info(f"Initializing connection pool to: {self.config.DATABASE_URL.split('@')[1] if '@' in self.config.DATABASE_URL else 'localhost'}")
-            self.pool = psycopg2.pool.SimpleConnectionPool(
-                1, 20, self.config.DATABASE_URL
+            logger.info(f"Initializing connection pool to: {self.dsn.split('@')[1] if '@' in self.dsn else 'localhost'}")
+            self.pool = psycopg2.pool.ThreadedConnectionPool(
+                self.config.DB_POOL_MIN_CONN, self.config.DB_POOL_MAX_CONN, self.dsn,
+                connect_timeout=self.config.DB_CONNECT_TIMEOUT
             )
             logger.info("Database connection pool initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize database pool: {e}")
             raise
     
+    def _record_wait(self, wait_seconds):
+        record_phase('pool_wait', wait_seconds)
+        with self.stats_lock:
+            # Moyenne mobile exponentielle de l'attente d'une connexion libre
+            self.avg_wait_ms = 0.8 * self.avg_wait_ms + 0.2 * wait_seconds * 1000
+
     def get_connection(self):
         if not self.pool:
             raise Exception("Database pool not initialized")
-        return self.pool.getconn()
+        started = time.perf_counter()
+        with self.stats_lock:
+            self.waiting += 1
+        try:
+            acquired = self.slots.acquire(timeout=self.config.DB_POOL_TIMEOUT)
+        finally:
+            with self.stats_lock:
+                self.waiting -= 1
+        self._record_wait(time.perf_counter() - started)
+        if not acquired:
+            raise PoolTimeoutError(f"No database connection available within {self.config.DB_POOL_TIMEOUT}s")
+        try:
+            conn = self.pool.getconn()
+        except Exception:
+            self.slots.release()
+            raise
+        with self.stats_lock:
+            self.checkout_times[id(conn)] = time.perf_counter()
+            self.connections_in_use += 1
+        return conn
     
     def return_connection(self, conn):
         if self.pool:
             self.pool.putconn(conn)
+            with self.stats_lock:
+                checked_out = self.checkout_times.pop(id(conn), None)
+                self.connections_in_use = max(0, self.connections_in_use - 1)
+            if checked_out is not None:
+                self.slots.release()
+                # Temps de détention de la connexion, soit l'essentiel du temps SQL
+                record_phase('sql', time.perf_counter() - checked_out)
+    
+    def pool_stats(self) -> dict:
+        """Occupation du pool de connexions"""
+        max_conn = self.config.DB_POOL_MAX_CONN
+        return {
+            "in_use": self.connections_in_use,
+            "max": max_conn,
+            "waiting": self.waiting,
+            "saturation": self.connections_in_use / max_conn if max_conn else 0.0,
+            "avg_wait_ms": round(self.avg_wait_ms, 3)
+        }
     
     def init_tables(self):
         """Initialiser les tables de la base de données"""
@@ -88,7 +158,7 @@ class DatabaseManager:
                     created_at=result['created_at'].isoformat() if result['created_at'] else None
                 )
                 
-                logger.info(f"User created successfully: {created_user.name} (ID: {created_user.id})")
+                logger.debug("User created successfully: %s (ID: %s)", created_user.name, created_user.id)
                 return created_user
                 
         except psycopg2.IntegrityError as e:
@@ -102,8 +172,8 @@ class DatabaseManager:
         finally:
             self.return_connection(conn)
     
-    def get_users(self) -> List[User]:
-        """Récupérer tous les utilisateurs"""
+    def get_users(self, limit: Optional[int] = None) -> List[User]:
+        """Récupérer les utilisateurs, les plus récents d'abord"""
         conn = self.get_connection()
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cursor:
@@ -112,7 +182,8 @@ class DatabaseManager:
                            created_at AT TIME ZONE 'UTC' as created_at
                     FROM users 
                     ORDER BY created_at DESC
-                """)
+                    LIMIT %s
+                """, (limit,))
                 results = cursor.fetchall()
                 
                 users = []
@@ -125,7 +196,7 @@ class DatabaseManager:
                     )
                     users.append(user)
                 
-                logger.info(f"Retrieved {len(users)} users from database")
+                logger.debug("Retrieved %d users from database", len(users))
                 return users
                 
         except Exception as e:
@@ -163,6 +234,44 @@ class DatabaseManager:
         finally:
             self.return_connection(conn)
     
+    def get_users_by_ids(self, user_ids: List[int]) -> Tuple[List[User], List[int]]:
+        """Récupérer plusieurs utilisateurs en une seule requête.
+
+        Retourne les utilisateurs trouvés dans l'ordre demandé et la liste des IDs absents.
+        """
+        unique_ids = list(dict.fromkeys(user_ids))
+        if not unique_ids:
+            return [], []
+        conn = self.get_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    SELECT id, name, email, 
+                           created_at AT TIME ZONE 'UTC' as created_at
+                    FROM users 
+                    WHERE id = ANY(%s)
+                """, (unique_ids,))
+                results = cursor.fetchall()
+                
+                found = {
+                    row['id']: User(
+                        id=row['id'],
+                        name=row['name'],
+                        email=row['email'],
+                        created_at=row['created_at'].isoformat() if row['created_at'] else None
+                    )
+                    for row in results
+                }
+                users = [found[user_id] for user_id in unique_ids if user_id in found]
+                missing = [user_id for user_id in unique_ids if user_id not in found]
+                return users, missing
+                
+        except Exception as e:
+            logger.error(f"Failed to get users {unique_ids}: {e}")
+            raise
+        finally:
+            self.return_connection(conn)
+    
     def update_user(self, user_id: int, user: User) -> Optional[User]:
         """Mettre à jour un utilisateur"""
         conn = self.get_connection()
@@ -190,7 +299,7 @@ class DatabaseManager:
                     created_at=result['created_at'].isoformat() if result['created_at'] else None
                 )
                 
-                logger.info(f"User updated successfully: {updated_user.name} (ID: {updated_user.id})")
+                logger.debug("User updated successfully: %s (ID: %s)", updated_user.name, updated_user.id)
                 return updated_user
                 
         except psycopg2.IntegrityError as e:
@@ -215,9 +324,9 @@ class DatabaseManager:
             conn.commit()
             
             if deleted:
-                logger.info(f"User deleted successfully: ID {user_id}")
+                logger.debug("User deleted successfully: ID %s", user_id)
             else:
-                logger.warning(f"No user found with ID {user_id} for deletion")
+                logger.debug("No user found with ID %s for deletion", user_id)
                 
             return deleted
             
@@ -232,10 +341,15 @@ class DatabaseManager:
         """Vérifier la santé de la connexion à la base de données"""
         try:
             conn = self.get_connection()
-            with conn.cursor() as cursor:
-                cursor.execute("SELECT 1")
-                result = cursor.fetchone()
-            self.return_connection(conn)
+            try:
+                with conn.cursor() as cursor:
+                    # Borné côté serveur ; HealthMonitor borne aussi l'attente côté client
+                    cursor.execute("SET LOCAL statement_timeout = %s", (int(self.config.HEALTH_CHECK_TIMEOUT * 1000),))
+                    cursor.execute("SELECT 1")
+                    result = cursor.fetchone()
+                conn.rollback()
+            finally:
+                self.return_connection(conn)
             
             is_healthy = result is not None
             if is_healthy:
@@ -255,7 +369,7 @@ class DatabaseManager:
             with conn.cursor() as cursor:
                 cursor.execute("SELECT COUNT(*) FROM users")
                 count = cursor.fetchone()[0]
-                logger.info(f"Total users in database: {count}")
+                logger.debug("Total users in database: %d", count)
                 return count
         except Exception as e:
             logger.error(f"Failed to get user count: {e}")
@@ -267,4 +381,68 @@ class DatabaseManager:
         """Fermer toutes les connexions du pool"""
         if self.pool:
             self.pool.closeall()
-            logger.info("All database connections closed")
\ No newline at end of file
+            logger.info("All database connections closed")
+
+
+def create_engine(config: Config) -> StorageEngine:
+    """Choisir le moteur de stockage selon le schéma de DATABASE_URL"""
+    url = config.DATABASE_URL
+    scheme = url.split('://', 1)[0].lower() if '://' in url else ''
+    if scheme in ('postgresql', 'postgres'):
+        if config.DATABASE_SHARDS:
+            # Import local : sharding.py s'appuie lui-même sur PostgresEngine
+            from sharding import ShardedPostgresEngine
+            return ShardedPostgresEngine(config)
+        if config.USERS_PARTITIONED:
+            from partitioning import PartitionedPostgresEngine
+            return PartitionedPostgresEngine(config)
+        return PostgresEngine(config)
+    if scheme == 'memory':
+        return MemoryEngine()
+    if scheme == 'sqlite':
+        # sqlite:///chemin/relatif.db, sqlite:////chemin/absolu.db ou sqlite://:memory:
+        path = url.split('://', 1)[1]
+        return SQLiteEngine(path[1:] if path.startswith('/') else path)
+    raise ValueError(f"Unsupported DATABASE_URL scheme: {scheme or url}")
+
+
+class DatabaseManager:
+    """Point d'entrée de l'application, délègue au moteur de stockage configuré"""
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.engine = create_engine(config)
+        logger.info(f"Using {self.engine.name} storage engine")
+    
+    def init_tables(self):
+        self.engine.init_tables()
+    
+    def create_user(self, user: User) -> User:
+        return self.engine.create_user(user)
+    
+    def get_users(self, limit: Optional[int] = None) -> List[User]:
+        return self.engine.get_users(limit)
+    
+    def get_user_by_id(self, user_id: int) -> Optional[User]:
+        return self.engine.get_user_by_id(user_id)
+    
+    def get_users_by_ids(self, user_ids: List[int]) -> Tuple[List[User], List[int]]:
+        return self.engine.get_users_by_ids(user_ids)
+    
+    def update_user(self, user_id: int, user: User) -> Optional[User]:
+        return self.engine.update_user(user_id, user)
+    
+    def delete_user(self, user_id: int) -> bool:
+        return self.engine.delete_user(user_id)
+    
+    def health_check(self) -> bool:
+        return self.engine.health_check()
+    
+    def get_user_count(self) -> int:
+        return self.engine.get_user_count()
+    
+    def pool_stats(self) -> Optional[dict]:
+        return self.engine.pool_stats()
+    
+    def close_all_connections(self):
+        self.engine.close_all_connections()
@@ -0,0 +1,150 @@
+# health.py - Surveillance en tâche de fond pour /health (liveness) et /ready (readiness)
+import logging
+import threading
+import time
+from flask import g, request
+from config import Config
+from ratelimit import CRITICAL_PATHS
+
+logger = logging.getLogger(__name__)
+
+
+class HealthMonitor:
+    """Vérifie la base à intervalle régulier ; les sondes ne lisent que l'état en cache"""
+
+    def __init__(self, config: Config, db_manager):
+        self.config = config
+        self.db_manager = db_manager
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        # Vérification en cours, exécutée hors du thread de surveillance
+        self.probe = None
+        self.probe_result = None
+        # État en cache
+        self.db_healthy = False
+        self.db_latency_ms = None
+        self.last_check = None
+        self.consecutive_failures = 0
+        self.error_rate = 0.0
+        # Compteurs de réponses sur l'intervalle en cours
+        self.window_requests = 0
+        self.window_errors = 0
+
+    def init_app(self, app):
+        app.after_request(self._after_request)
+
+    def _after_request(self, response):
+        # Les sondes diluent le taux, et un délestage (g.load_shed) est voulu : une
+        # instance qui déleste sous un pic doit rester dans le load-balancing. La
+        # saturation est déjà couverte par les critères du pool
+        if request.path in CRITICAL_PATHS or g.get('load_shed', False):
+            return response
+        with self.lock:
+            self.window_requests += 1
+            if response.status_code >= 500:
+                self.window_errors += 1
+        return response
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='health-monitor', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            self.check()
+            self.stop_event.wait(self.config.HEALTH_CHECK_INTERVAL)
+
+    def _probe(self):
+        self.probe_result = self.db_manager.health_check()
+
+    def _check_database(self):
+        """Vérifier la base en au plus HEALTH_CHECK_TIMEOUT secondes.
+
+        Une connexion bloquée (hôte injoignable, TCP à moitié ouvert) ne doit pas
+        bloquer la surveillance : la vérification tourne dans son propre thread,
+        et une vérification qui dépasse le délai compte comme un échec.
+        """
+        timeout = self.config.HEALTH_CHECK_TIMEOUT
+        if self.probe is not None and self.probe.is_alive():
+            # La vérification précédente est toujours bloquée : on n'en empile pas d'autre
+            return False, None
+        started = time.perf_counter()
+        self.probe_result = False
+        self.probe = threading.Thread(target=self._probe, name='health-probe', daemon=True)
+        self.probe.start()
+        self.probe.join(timeout)
+        latency_ms = round((time.perf_counter() - started) * 1000, 2)
+        if self.probe.is_alive():
+            logger.warning("Database health check timed out after %.1fs", timeout)
+            return False, latency_ms
+        return self.probe_result, latency_ms
+
+    def check(self):
+        """Un cycle de vérification (appelé par le thread de surveillance)"""
+        stats = self.db_manager.pool_stats()
+        if stats and stats['saturation'] >= 1:
+            # Pool plein : inutile d'attendre une connexion, la base n'est pas en cause
+            healthy, latency_ms = self.db_healthy, self.db_latency_ms
+        else:
+            healthy, latency_ms = self._check_database()
+
+        with self.lock:
+            if self.window_requests >= self.config.READY_MIN_REQUESTS:
+                self.error_rate = self.window_errors / self.window_requests
+            else:
+                self.error_rate = 0.0
+            self.window_requests = 0
+            self.window_errors = 0
+
+            if healthy != self.db_healthy:
+                logger.info("Database is now %s", "reachable" if healthy else "unreachable")
+            self.db_healthy = healthy
+            self.db_latency_ms = latency_ms
+            self.consecutive_failures = 0 if healthy else self.consecutive_failures + 1
+            self.last_check = time.monotonic()
+
+    def is_alive(self) -> bool:
+        """Liveness : le processus répond et le thread de surveillance progresse.
+
+        Chaque cycle est borné par HEALTH_CHECK_TIMEOUT : une base injoignable rend
+        l'instance "not ready", jamais "not alive" (pas de redémarrage en boucle).
+        """
+        if self.thread is not None and not self.thread.is_alive():
+            return False
+        if self.last_check is None:
+            return True
+        return time.monotonic() - self.last_check < self.config.HEALTH_STALE_AFTER
+
+    def not_ready_reasons(self):
+        """Raisons de retirer l'instance du load-balancing (liste vide = prête)"""
+        reasons = []
+        if self.last_check is None:
+            reasons.append("health monitor has not run yet")
+        elif not self.db_healthy:
+            reasons.append("database unreachable")
+        stats = self.db_manager.pool_stats()
+        if stats:
+            if stats['saturation'] >= self.config.READY_MAX_POOL_SATURATION:
+                reasons.append("database pool saturated")
+            if stats['avg_wait_ms'] >= self.config.READY_MAX_POOL_WAIT_MS:
+                reasons.append("database pool wait too high")
+        if self.error_rate >= self.config.READY_MAX_ERROR_RATE:
+            reasons.append("error rate too high")
+        return reasons
+
+    def snapshot(self) -> dict:
+        return {
+            "database": "connected" if self.db_healthy else "disconnected",
+            "database_latency_ms": self.db_latency_ms,
+            "consecutive_failures": self.consecutive_failures,
+            "last_check_age_s": round(time.monotonic() - self.last_check, 1) if self.last_check else None,
+            "error_rate": round(self.error_rate, 3),
+            "pool": self.db_manager.pool_stats()
+        }
@@ -0,0 +1,296 @@
+# idempotency.py - Clés d'idempotence pour les écritures (en-tête Idempotency-Key)
+import hashlib
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Optional, Tuple
+from flask import jsonify, make_response, request
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+STATE_CLAIMED = "claimed"
+STATE_IN_PROGRESS = "in_progress"
+STATE_COMPLETED = "completed"
+
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyStore:
+    """Interface des stores de déduplication"""
+
+    def init_tables(self):
+        pass
+
+    def claim(self, key: str, fingerprint: str) -> Tuple[str, Optional[dict]]:
+        """Réserver la clé. Retourne (état, enregistrement existant éventuel)"""
+        raise NotImplementedError
+
+    def wait(self, key: str, timeout: float) -> Optional[dict]:
+        """Attendre la fin de la requête qui détient la clé (None si délai dépassé)"""
+        raise NotImplementedError
+
+    def complete(self, key: str, status_code: int, body: str, content_type: str):
+        raise NotImplementedError
+
+    def release(self, key: str):
+        """Libérer la clé sans stocker de réponse (erreur serveur : le client peut réessayer)"""
+        raise NotImplementedError
+
+
+class MemoryIdempotencyStore(IdempotencyStore):
+    """Store en mémoire, borné et expirant (une seule instance de l'API)"""
+
+    def __init__(self, ttl: float, max_keys: int):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _purge(self, now):
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if entry['expires_at'] > now and len(self.entries) < self.max_keys:
+                break
+            if entry['status_code'] is None and entry['expires_at'] > now:
+                # Ne jamais évincer une requête en cours
+                break
+            self.entries.popitem(last=False)
+
+    def claim(self, key, fingerprint):
+        now = time.monotonic()
+        with self.lock:
+            self._purge(now)
+            entry = self.entries.get(key)
+            if entry and entry['expires_at'] > now:
+                state = STATE_IN_PROGRESS if entry['status_code'] is None else STATE_COMPLETED
+                return state, dict(entry)
+            self.entries[key] = {
+                'fingerprint': fingerprint,
+                'status_code': None,
+                'body': None,
+                'content_type': None,
+                'expires_at': now + self.ttl,
+                'done': threading.Event()
+            }
+            return STATE_CLAIMED, None
+
+    def wait(self, key, timeout):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if not entry['done'].wait(timeout):
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            return dict(entry) if entry and entry['status_code'] is not None else None
+
+    def complete(self, key, status_code, body, content_type):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            entry.update(status_code=status_code, body=body, content_type=content_type)
+            entry['done'].set()
+
+    def release(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+        if entry:
+            entry['done'].set()
+
+
+class PostgresIdempotencyStore(IdempotencyStore):
+    """Store partagé dans PostgreSQL, pour plusieurs réplicas de l'API.
+
+    Une clé en cours porte un bail (`claimed_at`) : si le réplica qui la détient
+    s'arrête avant `complete`, une nouvelle requête la reprend après `lease` secondes.
+    """
+
+    # Attente d'un doublon : sondage de plus en plus espacé pour ménager le pool
+    POLL_INITIAL = 0.05
+    POLL_MAX = 1.0
+
+    def __init__(self, engine, ttl: float, lease: float):
+        # engine : PostgresEngine (get_connection / return_connection)
+        self.engine = engine
+        self.ttl = ttl
+        self.lease = lease
+
+    def _execute(self, query, params=(), fetch=False):
+        conn = self.engine.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query, params)
+                result = cursor.fetchone() if fetch else None
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.engine.return_connection(conn)
+
+    def init_tables(self):
+        self._execute("""
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                key VARCHAR(512) PRIMARY KEY,
+                fingerprint CHAR(64) NOT NULL,
+                status_code INTEGER,
+                body TEXT,
+                content_type VARCHAR(100),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                claimed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        self._execute(
+            "ALTER TABLE idempotency_keys ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP"
+        )
+        self._execute("CREATE INDEX IF NOT EXISTS idx_idempotency_created_at ON idempotency_keys(created_at)")
+        logger.info("Idempotency table initialized successfully")
+
+    def _get(self, key):
+        row = self._execute("""
+            SELECT fingerprint, status_code, body, content_type,
+                   status_code IS NULL AND claimed_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+            FROM idempotency_keys
+            WHERE key = %s AND created_at > CURRENT_TIMESTAMP - make_interval(secs => %s)
+        """, (self.lease, key, self.ttl), fetch=True)
+        if not row:
+            return None
+        return {
+            'fingerprint': row[0], 'status_code': row[1], 'body': row[2], 'content_type': row[3],
+            'lease_expired': row[4]
+        }
+
+    def _take_over(self, key, fingerprint) -> bool:
+        """Reprendre une clé dont le détenteur a disparu (bail expiré, même requête)"""
+        return self._execute("""
+            UPDATE idempotency_keys SET claimed_at = CURRENT_TIMESTAMP
+            WHERE key = %s AND fingerprint = %s AND status_code IS NULL
+              AND claimed_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+            RETURNING key
+        """, (key, fingerprint, self.lease), fetch=True) is not None
+
+    def claim(self, key, fingerprint):
+        # Purge opportuniste des clés expirées
+        if random.random() < 0.01:
+            self._execute(
+                "DELETE FROM idempotency_keys WHERE created_at < CURRENT_TIMESTAMP - make_interval(secs => %s)",
+                (self.ttl,)
+            )
+        claimed = self._execute("""
+            INSERT INTO idempotency_keys (key, fingerprint) VALUES (%s, %s)
+            ON CONFLICT (key) DO NOTHING
+            RETURNING key
+        """, (key, fingerprint), fetch=True)
+        if claimed:
+            return STATE_CLAIMED, None
+        record = self._get(key)
+        if record is None:
+            # Clé expirée mais pas encore purgée : on la remplace
+            self._execute("DELETE FROM idempotency_keys WHERE key = %s", (key,))
+            return self.claim(key, fingerprint)
+        if record['lease_expired'] and self._take_over(key, fingerprint):
+            logger.warning("Took over abandoned idempotency key %s", key)
+            return STATE_CLAIMED, None
+        return (STATE_IN_PROGRESS if record['status_code'] is None else STATE_COMPLETED), record
+
+    def wait(self, key, timeout):
+        deadline = time.monotonic() + timeout
+        interval = self.POLL_INITIAL
+        while time.monotonic() < deadline:
+            record = self._get(key)
+            if record is None:
+                return None
+            if record['status_code'] is not None:
+                return record
+            if record['lease_expired']:
+                # Détenteur disparu : le client réessaie et reprendra la clé
+                return None
+            time.sleep(min(interval, max(0.0, deadline - time.monotonic())))
+            interval = min(interval * 2, self.POLL_MAX)
+        return None
+
+    def complete(self, key, status_code, body, content_type):
+        self._execute(
+            "UPDATE idempotency_keys SET status_code = %s, body = %s, content_type = %s WHERE key = %s",
+            (status_code, body, content_type, key)
+        )
+
+    def release(self, key):
+        self._execute("DELETE FROM idempotency_keys WHERE key = %s", (key,))
+
+
+class Idempotency:
+    """Décorateur de route : rejoue la réponse stockée pour une Idempotency-Key déjà vue"""
+
+    def __init__(self, config: Config, store: IdempotencyStore):
+        self.config = config
+        self.store = store
+
+    def _replay(self, record):
+        response = make_response(record['body'] or '', record['status_code'])
+        if record['content_type']:
+            response.headers['Content-Type'] = record['content_type']
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response
+
+    def idempotent(self, view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get('Idempotency-Key')
+            if not key:
+                return view(*args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return jsonify({"error": f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters"}), 400
+
+            scoped_key = f"{request.method}:{request.path}:{key}"
+            fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+            state, record = self.store.claim(scoped_key, fingerprint)
+
+            if state == STATE_IN_PROGRESS:
+                # Doublon concurrent : on attend la première requête au lieu de la concurrencer
+                record = self.store.wait(scoped_key, self.config.IDEMPOTENCY_WAIT_TIMEOUT)
+                if record is None:
+                    response = jsonify({"error": "A request with this Idempotency-Key is in progress"})
+                    response.status_code = 409
+                    response.headers['Retry-After'] = '1'
+                    return response
+
+            if record is not None:
+                if record['fingerprint'] != fingerprint:
+                    return jsonify({"error": "Idempotency-Key reused with a different request body"}), 422
+                logger.debug("Replaying response for idempotency key %s", key)
+                return self._replay(record)
+
+            try:
+                response = make_response(view(*args, **kwargs))
+            except Exception:
+                self.store.release(scoped_key)
+                raise
+
+            if response.status_code >= 500:
+                self.store.release(scoped_key)
+            else:
+                self.store.complete(scoped_key, response.status_code, response.get_data(as_text=True), response.content_type)
+            return response
+        return wrapper
+
+
+def create_store(config: Config, db_manager) -> IdempotencyStore:
+    """Choisir le store selon IDEMPOTENCY_BACKEND (memory ou postgres)"""
+    if config.IDEMPOTENCY_BACKEND == 'postgres':
+        engine = db_manager.engine
+        # Avec le sharding, la table vit dans la base annuaire
+        engine = getattr(engine, 'directory', engine)
+        if not hasattr(engine, 'get_connection'):
+            raise ValueError("IDEMPOTENCY_BACKEND=postgres requires a PostgreSQL DATABASE_URL")
+        return PostgresIdempotencyStore(engine, config.IDEMPOTENCY_TTL, config.IDEMPOTENCY_LEASE)
+    if config.IDEMPOTENCY_BACKEND == 'memory':
+        return MemoryIdempotencyStore(config.IDEMPOTENCY_TTL, config.IDEMPOTENCY_MAX_KEYS)
+    raise ValueError(f"Unsupported IDEMPOTENCY_BACKEND: {config.IDEMPOTENCY_BACKEND}")
@@ -0,0 +1,243 @@
+# manage_partitions.py - Maintenance de la table users partitionnée par mois
+#
+# Usage : DATABASE_URL=... USERS_PARTITIONED=true python manage_partitions.py <commande>
+#
+#   migrate                   convertit une table users classique en table partitionnée
+#   ensure                    crée les partitions jusqu'à PARTITION_MONTHS_AHEAD mois
+#   list                      liste les partitions attachées et les archives
+#   archive --older-than N    archive (CSV gzip dans ARCHIVE_DIR) les partitions de plus de N mois
+#   archive PARTITION         archive une partition donnée
+#   query-archive PARTITION   relit une archive (--id pour un seul utilisateur)
+#   benchmark --rows N        compare table classique et table partitionnée sur N lignes
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+from config import Config
+from partitioning import (
+    PartitionedPostgresEngine, SCHEMA_SQL, TABLES_SQL, TRIGGER_SQL, create_partition_sql, month_start
+)
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_SCHEMA = 'partition_benchmark'
+BENCHMARK_MONTHS = 24
+
+
+def migrate(engine: PartitionedPostgresEngine):
+    """Recopier une table users classique dans une table partitionnée, mois par mois"""
+    partitioned = engine.is_partitioned()
+    if partitioned is None:
+        engine.init_tables()
+        logger.info("No users table found: partitioned table created")
+        return
+    if partitioned:
+        logger.info("users is already partitioned")
+        return
+
+    conn = engine.get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("LOCK TABLE users IN EXCLUSIVE MODE")
+            cursor.execute("SELECT min(created_at), count(*) FROM users")
+            oldest, count = cursor.fetchone()
+            cursor.execute("ALTER TABLE users RENAME TO users_legacy")
+            cursor.execute(SCHEMA_SQL)
+            month = month_start((oldest or datetime.utcnow()).date())
+            last = month_start(datetime.utcnow().date(), engine.config.PARTITION_MONTHS_AHEAD)
+            while month <= last:
+                cursor.execute(create_partition_sql(month))
+                month = month_start(month, 1)
+            # Le trigger alimente user_identities ligne à ligne pendant la copie
+            cursor.execute("""
+                INSERT INTO users (id, name, email, created_at)
+                SELECT id, name, email, COALESCE(created_at, CURRENT_TIMESTAMP)
+                FROM users_legacy
+                ORDER BY created_at
+            """)
+            cursor.execute("SELECT setval(pg_get_serial_sequence('users', 'id'), COALESCE(max(id), 0) + 1, false) FROM users")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        engine.return_connection(conn)
+    logger.info(f"Migrated {count} users; the previous table is kept as users_legacy")
+
+
+def list_partitions(engine: PartitionedPostgresEngine):
+    conn = engine.get_connection()
+    try:
+        with conn.cursor() as cursor:
+            for name in engine.list_partitions():
+                cursor.execute(f"SELECT count(*) FROM {name}")
+                print(f"{name}\tattached\t{cursor.fetchone()[0]} rows")
+        conn.commit()
+    finally:
+        engine.return_connection(conn)
+    if os.path.isdir(engine.config.ARCHIVE_DIR):
+        for filename in sorted(os.listdir(engine.config.ARCHIVE_DIR)):
+            if filename.endswith('.csv.gz'):
+                size = os.path.getsize(os.path.join(engine.config.ARCHIVE_DIR, filename))
+                print(f"{filename[:-len('.csv.gz')]}\tarchived\t{size} bytes")
+
+
+def timed_query(cursor, query, params=None, repeat=5):
+    """Médiane du temps d'exécution (ms) de `repeat` exécutions"""
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        cursor.execute(query, params)
+        cursor.fetchall()
+        durations.append((time.perf_counter() - started) * 1000)
+    return statistics.median(durations)
+
+
+def benchmark(engine: PartitionedPostgresEngine, rows: int):
+    """Charger `rows` utilisateurs sur BENCHMARK_MONTHS mois dans les deux schémas et comparer"""
+    conn = engine.get_connection()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {BENCHMARK_SCHEMA} CASCADE")
+            cursor.execute(f"CREATE SCHEMA {BENCHMARK_SCHEMA}")
+            cursor.execute(f"SET search_path TO {BENCHMARK_SCHEMA}")
+
+            cursor.execute("""
+                CREATE TABLE users_flat (
+                    id BIGSERIAL PRIMARY KEY,
+                    name VARCHAR(50) UNIQUE NOT NULL,
+                    email VARCHAR(100) UNIQUE NOT NULL,
+                    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                );
+                CREATE INDEX ON users_flat(created_at DESC);
+            """)
+            cursor.execute(TABLES_SQL)
+            current = month_start(datetime.utcnow().date())
+            for offset in range(-BENCHMARK_MONTHS, 2):
+                cursor.execute(create_partition_sql(month_start(current, offset)))
+
+            started = time.perf_counter()
+            cursor.execute(f"""
+                INSERT INTO users_flat (id, name, email, created_at)
+                SELECT i, 'user' || i, 'user' || i || '@example.com',
+                       now()::timestamp - (random() * interval '{BENCHMARK_MONTHS * 30} days')
+                FROM generate_series(1, %s) AS i
+            """, (rows,))
+            logger.info(f"users_flat loaded in {time.perf_counter() - started:.1f}s")
+
+            # Chargement en masse : identités insérées d'un bloc, trigger créé après la copie
+            started = time.perf_counter()
+            cursor.execute("INSERT INTO users SELECT * FROM users_flat")
+            cursor.execute("""
+                INSERT INTO user_identities (user_id, name, email, created_at)
+                SELECT id, name, email, created_at FROM users_flat
+            """)
+            cursor.execute(TRIGGER_SQL)
+            cursor.execute("SELECT setval(pg_get_serial_sequence('users', 'id'), %s)", (rows,))
+            cursor.execute("SELECT setval(pg_get_serial_sequence('users_flat', 'id'), %s)", (rows,))
+            cursor.execute("ANALYZE users_flat; ANALYZE users; ANALYZE user_identities")
+            logger.info(f"users (partitioned) loaded in {time.perf_counter() - started:.1f}s")
+
+            cursor.execute("SELECT id FROM users_flat TABLESAMPLE SYSTEM (1) LIMIT 1")
+            sample_id = cursor.fetchone()[0]
+            queries = [
+                ("recent page (LIMIT 50)",
+                 "SELECT id, name, email, created_at FROM {table} ORDER BY created_at DESC LIMIT 50", None),
+                ("last 7 days count",
+                 "SELECT count(*) FROM {table} WHERE created_at > now() - interval '7 days'", None),
+                ("one month range",
+                 "SELECT id FROM {table} WHERE created_at >= %s AND created_at < %s",
+                 (month_start(current, -3), month_start(current, -2))),
+                ("point lookup by id", "SELECT id, name FROM {table} WHERE id = %s", (sample_id,)),
+            ]
+
+            print(f"{'query':<28}{'flat (ms)':>12}{'partitioned (ms)':>18}")
+            for label, query, params in queries:
+                flat = timed_query(cursor, query.format(table='users_flat'), params)
+                partitioned = timed_query(cursor, query.format(table='users'), params)
+                print(f"{label:<28}{flat:>12.2f}{partitioned:>18.2f}")
+
+            # Écritures : le partitionnement ajoute l'insertion dans user_identities
+            insert_times = []
+            for table in ('users_flat', 'users'):
+                started = time.perf_counter()
+                cursor.execute(f"""
+                    INSERT INTO {table} (name, email)
+                    SELECT 'bench' || i, 'bench' || i || '@example.com' FROM generate_series(1, 1000) AS i
+                """)
+                insert_times.append((time.perf_counter() - started) * 1000)
+            print(f"{'insert 1000 rows':<28}{insert_times[0]:>12.2f}{insert_times[1]:>18.2f}")
+
+            # Purge d'un mois : DELETE sur la table classique contre DETACH + DROP
+            oldest = month_start(current, -BENCHMARK_MONTHS)
+            started = time.perf_counter()
+            cursor.execute("DELETE FROM users_flat WHERE created_at < %s", (month_start(oldest, 1),))
+            flat = (time.perf_counter() - started) * 1000
+            started = time.perf_counter()
+            cursor.execute(f"ALTER TABLE users DETACH PARTITION users_p{oldest:%Y%m}")
+            cursor.execute(f"DROP TABLE users_p{oldest:%Y%m}")
+            partitioned = (time.perf_counter() - started) * 1000
+            print(f"{'drop oldest month':<28}{flat:>12.2f}{partitioned:>18.2f}")
+
+            cursor.execute(f"DROP SCHEMA {BENCHMARK_SCHEMA} CASCADE")
+    finally:
+        conn.autocommit = False
+        engine.return_connection(conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the month-partitioned users table")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('migrate', help="convert a plain users table to a partitioned one")
+    commands.add_parser('ensure', help="create upcoming monthly partitions")
+    commands.add_parser('list', help="list attached and archived partitions")
+    archive = commands.add_parser('archive', help="detach, export and drop old partitions")
+    archive.add_argument('partition', nargs='?', help="partition to archive, e.g. users_p202301")
+    archive.add_argument('--older-than', type=int, help="archive partitions older than N months")
+    query = commands.add_parser('query-archive', help="read users back from an archived partition")
+    query.add_argument('partition')
+    query.add_argument('--id', type=int, help="only print this user")
+    bench = commands.add_parser('benchmark', help="compare plain and partitioned tables")
+    bench.add_argument('--rows', type=int, default=10_000_000)
+    args = parser.parse_args()
+
+    config = Config()
+    logging.basicConfig(level=getattr(logging, config.LOG_LEVEL.upper()), format=config.LOG_FORMAT)
+    engine = PartitionedPostgresEngine(config)
+
+    try:
+        if args.command == 'migrate':
+            migrate(engine)
+        elif args.command == 'ensure':
+            for name in engine.ensure_partitions():
+                print(name)
+        elif args.command == 'list':
+            list_partitions(engine)
+        elif args.command == 'archive':
+            if args.partition:
+                path = engine.archive_partition(args.partition)
+                if path:
+                    print(path)
+            elif args.older_than is not None:
+                for path in engine.archive_older_than(args.older_than):
+                    print(path)
+            else:
+                parser.error("archive needs a partition name or --older-than")
+        elif args.command == 'query-archive':
+            for user in engine.read_archive(args.partition, args.id):
+                print(user.to_dict())
+        elif args.command == 'benchmark':
+            benchmark(engine, args.rows)
+    except Exception as e:
+        logger.error(f"{args.command} failed: {e}")
+        sys.exit(1)
+    finally:
+        engine.close_all_connections()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,379 @@
+# partitioning.py - Table users partitionnée par mois sur created_at
+import csv
+import gzip
+import logging
+import os
+import threading
+from datetime import date, datetime
+from typing import List, Optional
+from psycopg2.extras import RealDictCursor
+from config import Config
+from database import PostgresEngine
+from models import User
+
+logger = logging.getLogger(__name__)
+
+PARTITION_PREFIX = 'users_p'
+
+# Verrou consultatif : une seule instance crée ou archive des partitions à la fois
+MAINTENANCE_LOCK_ID = 727001
+# Verrou distinct pour l'installation du schéma : un démarrage n'attend pas la fin d'un archivage
+SCHEMA_LOCK_ID = 727002
+
+TABLES_SQL = """
+    CREATE TABLE IF NOT EXISTS users (
+        id BIGSERIAL,
+        name VARCHAR(50) NOT NULL,
+        email VARCHAR(100) NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at);
+
+    CREATE INDEX IF NOT EXISTS idx_partitioned_users_created_at ON users(created_at DESC);
+
+    -- Une contrainte UNIQUE sur une table partitionnée doit inclure la clé de
+    -- partitionnement : l'unicité globale de name/email est portée par cette table
+    CREATE TABLE IF NOT EXISTS user_identities (
+        user_id BIGINT PRIMARY KEY,
+        name VARCHAR(50) UNIQUE NOT NULL,
+        email VARCHAR(100) UNIQUE NOT NULL,
+        created_at TIMESTAMP NOT NULL,
+        archived_partition VARCHAR(63)
+    );
+"""
+
+# Synchronise user_identities avec users (DETACH PARTITION ne le déclenche pas)
+FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION sync_user_identity() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            INSERT INTO user_identities (user_id, name, email, created_at)
+            VALUES (NEW.id, NEW.name, NEW.email, NEW.created_at);
+            RETURN NEW;
+        ELSIF TG_OP = 'UPDATE' THEN
+            UPDATE user_identities SET name = NEW.name, email = NEW.email WHERE user_id = OLD.id;
+            RETURN NEW;
+        END IF;
+        DELETE FROM user_identities WHERE user_id = OLD.id;
+        RETURN OLD;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+# Recréation inconditionnelle : réservée à migrate et benchmark
+TRIGGER_SQL = FUNCTION_SQL + """
+    DROP TRIGGER IF EXISTS users_identity_sync ON users;
+    CREATE TRIGGER users_identity_sync
+        AFTER INSERT OR UPDATE OR DELETE ON users
+        FOR EACH ROW EXECUTE FUNCTION sync_user_identity();
+"""
+
+SCHEMA_SQL = TABLES_SQL + TRIGGER_SQL
+
+# Schéma déjà en place ? DROP/CREATE TRIGGER et CREATE INDEX IF NOT EXISTS verrouillent
+# users et toutes ses partitions même quand l'objet existe : au démarrage d'une
+# réplique, on ne les exécute que s'il manque quelque chose
+SCHEMA_STATUS_SQL = """
+    SELECT to_regclass('user_identities') IS NOT NULL
+       AND to_regclass('idx_partitioned_users_created_at') IS NOT NULL
+       AND EXISTS (
+           SELECT 1 FROM pg_trigger
+           WHERE tgrelid = to_regclass('users') AND tgname = 'users_identity_sync'
+       )
+"""
+
+
+def month_start(day: date, offset: int = 0) -> date:
+    """Premier jour du mois de `day`, décalé de `offset` mois"""
+    index = day.year * 12 + day.month - 1 + offset
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARTITION_PREFIX}{month:%Y%m}"
+
+
+def create_partition_sql(month: date) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF users "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{month_start(month, 1).isoformat()}')"
+    )
+
+
+class PartitionedPostgresEngine(PostgresEngine):
+    """PostgresEngine sur une table users partitionnée par mois.
+
+    Les requêtes SQL du moteur de base restent valables : les listes triées par
+    created_at DESC avec LIMIT parcourent les partitions de la plus récente à la
+    plus ancienne (Append ordonné) et s'arrêtent dès que la limite est atteinte.
+    """
+
+    name = "partitioned-postgres"
+
+    def __init__(self, config: Config):
+        super().__init__(config)
+        self.stop_event = threading.Event()
+        self.maintenance_thread = None
+
+    def _run(self, sql, params=None):
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(sql, params)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.return_connection(conn)
+
+    def is_partitioned(self) -> Optional[bool]:
+        """True/False selon la nature de la table users, None si elle n'existe pas"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT relkind FROM pg_class WHERE relname = 'users' AND relnamespace = 'public'::regnamespace")
+                row = cursor.fetchone()
+            conn.commit()
+            return None if row is None else row[0] == 'p'
+        finally:
+            self.return_connection(conn)
+
+    def init_tables(self):
+        partitioned = self.is_partitioned()
+        if partitioned is False:
+            raise Exception("users is not partitioned: run `python manage_partitions.py migrate` first")
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_ID,))
+                cursor.execute(SCHEMA_STATUS_SQL)
+                # La fonction se remplace sans verrouiller users : une nouvelle version est toujours déployée
+                cursor.execute(FUNCTION_SQL if cursor.fetchone()[0] else SCHEMA_SQL)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.return_connection(conn)
+        self.ensure_partitions()
+        self.start_maintenance()
+        logger.info("Partitioned users table initialized successfully")
+
+    # --- Maintenance des partitions ---
+
+    def list_partitions(self) -> List[str]:
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT child.relname
+                    FROM pg_inherits
+                    JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+                    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                    WHERE parent.relname = 'users'
+                    ORDER BY child.relname
+                """)
+                names = [row[0] for row in cursor.fetchall()]
+            conn.commit()
+            return names
+        finally:
+            self.return_connection(conn)
+
+    def ensure_partitions(self, since: Optional[date] = None) -> List[str]:
+        """Créer les partitions du mois `since` (par défaut le mois courant) à PARTITION_MONTHS_AHEAD mois"""
+        first = month_start(since or datetime.utcnow().date())
+        last = month_start(datetime.utcnow().date(), self.config.PARTITION_MONTHS_AHEAD)
+        months = []
+        month = first
+        while month <= last:
+            months.append(month)
+            month = month_start(month, 1)
+
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MAINTENANCE_LOCK_ID,))
+                for month in months:
+                    cursor.execute(create_partition_sql(month))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Failed to create partitions: {e}")
+            raise
+        finally:
+            self.return_connection(conn)
+        return [partition_name(month) for month in months]
+
+    def archive_path(self, name: str) -> str:
+        return os.path.join(self.config.ARCHIVE_DIR, f"{name}.csv.gz")
+
+    def archive_partition(self, name: str) -> Optional[str]:
+        """Détacher une partition, l'exporter en CSV gzip puis la supprimer.
+
+        Aucune étape ne bloque users pendant l'export : DETACH ... CONCURRENTLY ne
+        prend qu'un verrou SHARE UPDATE EXCLUSIVE, et l'export lit la table déjà
+        détachée. Chaque étape tourne dans sa propre transaction (autocommit).
+        Retourne None si la partition n'existe plus (archivée par une autre instance).
+        """
+        if not name.startswith(PARTITION_PREFIX) or not name[len(PARTITION_PREFIX):].isdigit():
+            raise ValueError(f"Not a users partition: {name}")
+        month = datetime.strptime(name[len(PARTITION_PREFIX):], '%Y%m').date()
+        os.makedirs(self.config.ARCHIVE_DIR, exist_ok=True)
+        path = self.archive_path(name)
+        partial_path = f"{path}.partial"
+
+        conn = self.get_connection()
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                # Verrou de session : il couvre les transactions successives ci-dessous
+                cursor.execute("SELECT pg_advisory_lock(%s)", (MAINTENANCE_LOCK_ID,))
+                try:
+                    # La liste a pu être lue avant qu'une autre instance n'archive la partition
+                    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+                    if not cursor.fetchone()[0]:
+                        logger.info(f"Partition {name} no longer exists, skipping")
+                        return None
+                    self._archive_locked(cursor, name, month, path, partial_path)
+                finally:
+                    cursor.execute("SELECT pg_advisory_unlock(%s)", (MAINTENANCE_LOCK_ID,))
+        except Exception as e:
+            logger.error(f"Failed to archive partition {name}: {e}")
+            raise
+        finally:
+            conn.autocommit = False
+            self.return_connection(conn)
+        logger.info(f"Partition {name} archived to {path}")
+        return path
+
+    def _archive_locked(self, cursor, name: str, month: date, path: str, partial_path: str):
+        """Étapes de l'archivage, sous le verrou de maintenance"""
+        marked = detached = False
+        try:
+            # Marqués avant le détachement : les lectures savent que l'utilisateur est archivé.
+            # DETACH ne déclenche pas les triggers : les identités restent et
+            # l'unicité de name/email couvre donc aussi les utilisateurs archivés
+            cursor.execute(
+                f"UPDATE user_identities SET archived_partition = %s WHERE user_id IN (SELECT id FROM {name})",
+                (name,)
+            )
+            marked = True
+            cursor.execute("""
+                SELECT inhdetachpending FROM pg_inherits
+                WHERE inhrelid = %s::regclass AND inhparent = 'users'::regclass
+            """, (name,))
+            row = cursor.fetchone()
+            if row is not None:
+                # Un DETACH CONCURRENTLY interrompu se termine avec FINALIZE
+                mode = "FINALIZE" if row[0] else "CONCURRENTLY"
+                cursor.execute(f"ALTER TABLE users DETACH PARTITION {name} {mode}")
+            detached = True
+
+            with gzip.open(partial_path, 'wt', encoding='utf-8', newline='') as archive:
+                cursor.copy_expert(
+                    f"COPY (SELECT id, name, email, created_at FROM {name} ORDER BY created_at) TO STDOUT WITH CSV HEADER",
+                    archive
+                )
+            # Renommage atomique : les autres instances ne lisent jamais un fichier partiel
+            os.replace(partial_path, path)
+            cursor.execute(f"DROP TABLE {name}")
+        except Exception:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            # Ne défaire que ce que cet appel a fait, et seulement si l'archive n'existe pas
+            if not os.path.exists(path):
+                if detached:
+                    cursor.execute(
+                        f"ALTER TABLE users ATTACH PARTITION {name} "
+                        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{month_start(month, 1).isoformat()}')"
+                    )
+                if marked:
+                    cursor.execute(
+                        "UPDATE user_identities SET archived_partition = NULL WHERE archived_partition = %s",
+                        (name,)
+                    )
+            raise
+
+    def archive_older_than(self, months: int) -> List[str]:
+        """Archiver les partitions antérieures à `months` mois"""
+        cutoff = partition_name(month_start(datetime.utcnow().date(), -months))
+        paths = [self.archive_partition(name) for name in self.list_partitions() if name < cutoff]
+        return [path for path in paths if path]
+
+    def read_archive(self, name: str, user_id: Optional[int] = None) -> List[User]:
+        """Relire une partition archivée (éventuellement un seul utilisateur).
+
+        Décompresse et parcourt tout le fichier : réservé à `manage_partitions.py query-archive`,
+        jamais appelé depuis une requête HTTP.
+        """
+        path = self.archive_path(name)
+        users = []
+        with gzip.open(path, 'rt', encoding='utf-8', newline='') as archive:
+            for row in csv.DictReader(archive):
+                if user_id is not None and int(row['id']) != user_id:
+                    continue
+                users.append(User(
+                    id=int(row['id']),
+                    name=row['name'],
+                    email=row['email'],
+                    created_at=datetime.fromisoformat(row['created_at']).isoformat()
+                ))
+                if user_id is not None:
+                    break
+        return users
+
+    def _maintain(self):
+        while not self.stop_event.wait(self.config.PARTITION_MAINTENANCE_INTERVAL):
+            try:
+                self.ensure_partitions()
+                if self.config.PARTITION_RETENTION_MONTHS > 0:
+                    self.archive_older_than(self.config.PARTITION_RETENTION_MONTHS)
+            except Exception as e:
+                logger.error(f"Partition maintenance failed: {e}")
+
+    def start_maintenance(self):
+        if self.maintenance_thread and self.maintenance_thread.is_alive():
+            return
+        self.maintenance_thread = threading.Thread(target=self._maintain, name='partition-maintenance', daemon=True)
+        self.maintenance_thread.start()
+
+    # --- Lectures ---
+
+    def get_user_by_id(self, user_id: int) -> Optional[User]:
+        """Lecture ponctuelle : created_at lu dans user_identities permet d'élaguer les partitions.
+
+        Un utilisateur archivé n'est plus dans users : il est absent ici comme dans
+        get_users_by_ids, et se relit avec `manage_partitions.py query-archive`.
+        """
+        conn = self.get_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    SELECT id, name, email,
+                           created_at AT TIME ZONE 'UTC' as created_at
+                    FROM users
+                    WHERE id = %s
+                      AND created_at = (SELECT created_at FROM user_identities WHERE user_id = %s)
+                """, (user_id, user_id))
+                result = cursor.fetchone()
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Failed to get user {user_id}: {e}")
+            raise
+        finally:
+            self.return_connection(conn)
+
+        if result:
+            return User(
+                id=result['id'],
+                name=result['name'],
+                email=result['email'],
+                created_at=result['created_at'].isoformat() if result['created_at'] else None
+            )
+        return None
+
+    def close_all_connections(self):
+        self.stop_event.set()
+        super().close_all_connections()
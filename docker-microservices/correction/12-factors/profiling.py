@@ -0,0 +1,115 @@
+# profiling.py - Profileur par échantillonnage et chronométrage des phases de requête
+import logging
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from flask import g, request
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Chronométrage par thread : inactif (aucun coût) en dehors d'une requête
+_local = threading.local()
+
+
+def record_phase(name: str, seconds: float):
+    """Ajouter une durée à la phase `name` de la requête en cours"""
+    phases = getattr(_local, 'phases', None)
+    if phases is not None:
+        phases[name] = phases.get(name, 0.0) + seconds
+
+
+def current_phases() -> dict:
+    """Phases déjà chronométrées pour la requête en cours"""
+    return getattr(_local, 'phases', None) or {}
+
+
+@contextmanager
+def timed(name: str):
+    """Chronométrer un bloc comme phase de la requête en cours"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - started)
+
+
+class SamplingProfiler:
+    """Profileur statistique : échantillonne la pile de tous les threads"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.lock = threading.Lock()
+
+    def _collapse(self, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def profile(self, seconds: float) -> Counter:
+        """Échantillonner pendant `seconds`. Retourne {pile repliée: nombre d'échantillons}"""
+        if not self.lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            samples = Counter()
+            current = threading.get_ident()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id != current:
+                        samples[self._collapse(frame)] += 1
+                time.sleep(self.interval)
+            return samples
+        finally:
+            self.lock.release()
+
+    @staticmethod
+    def to_collapsed(samples: Counter) -> str:
+        """Format "pile;repliée nombre", directement utilisable par flamegraph.pl / speedscope"""
+        return '\n'.join(f"{stack} {count}" for stack, count in samples.most_common()) + '\n'
+
+
+class SlowRequestLog:
+    """Garde les dernières requêtes lentes et le détail de leurs phases"""
+
+    def __init__(self, config: Config):
+        self.threshold = config.SLOW_REQUEST_MS / 1000
+        self.entries = deque(maxlen=config.SLOW_REQUEST_BUFFER)
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def _before_request(self):
+        _local.phases = {}
+        g.profiling_started = time.perf_counter()
+
+    def _teardown_request(self, exc):
+        phases = getattr(_local, 'phases', None)
+        _local.phases = None
+        started = g.pop('profiling_started', None)
+        if started is None or phases is None:
+            return
+        duration = time.perf_counter() - started
+        if duration < self.threshold:
+            return
+        entry = {
+            "method": request.method,
+            "path": request.path,
+            "duration_ms": round(duration * 1000, 2),
+            "phases_ms": {name: round(value * 1000, 2) for name, value in phases.items()},
+            "timestamp": time.time()
+        }
+        with self.lock:
+            self.entries.append(entry)
+
+    def slowest(self, limit: int = None):
+        with self.lock:
+            entries = sorted(self.entries, key=lambda entry: entry['duration_ms'], reverse=True)
+        return entries[:limit] if limit else entries
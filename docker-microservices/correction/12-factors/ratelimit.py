@@ -0,0 +1,170 @@
+# ratelimit.py - Limitation de débit et délestage de charge
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from flask import g, jsonify, request
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Priorités des routes : les sondes passent toujours, les lectures avant les écritures
+PRIORITY_CRITICAL = "critical"
+PRIORITY_READ = "read"
+PRIORITY_WRITE = "write"
+
+CRITICAL_PATHS = {'/health', '/ready'}
+# Routes en POST qui ne font que lire
+READ_PATHS = {'/users/batch-get'}
+READ_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+
+class TokenBucket:
+    """Seau à jetons thread-safe"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, tokens: float = 1, reserve: float = 0):
+        """Consommer des jetons. Retourne (accepté, secondes avant de réessayer).
+
+        `reserve` laisse un minimum de jetons disponibles pour les requêtes
+        plus prioritaires.
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens - tokens >= reserve:
+                self.tokens -= tokens
+                return True, 0
+            missing = tokens + reserve - self.tokens
+            return False, missing / self.rate if self.rate > 0 else 60
+
+
+class RateLimiter:
+    """Middleware Flask : seaux global et par client, délestage sur surcharge"""
+
+    def __init__(self, config: Config, db_manager=None):
+        self.config = config
+        self.db_manager = db_manager
+        self.enabled = config.RATE_LIMIT_ENABLED
+        self.global_bucket = TokenBucket(config.RATE_LIMIT_GLOBAL_RPS, config.RATE_LIMIT_GLOBAL_BURST)
+        self.client_buckets = OrderedDict()
+        self.clients_lock = threading.Lock()
+        self.in_flight = 0
+        self.in_flight_lock = threading.Lock()
+        self.shed_count = 0
+        self.limited_count = 0
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def _client_key(self):
+        # X-Forwarded-For n'est jamais lu ici : falsifiable par le client, il ne
+        # compte que derrière un proxy de confiance, via ProxyFix (TRUSTED_PROXY_HOPS)
+        return request.remote_addr or 'unknown'
+
+    def _client_bucket(self, key):
+        with self.clients_lock:
+            bucket = self.client_buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.config.RATE_LIMIT_CLIENT_RPS, self.config.RATE_LIMIT_CLIENT_BURST)
+                self.client_buckets[key] = bucket
+                # Borner la mémoire : on oublie les clients les moins récents
+                if len(self.client_buckets) > self.config.RATE_LIMIT_MAX_CLIENTS:
+                    self.client_buckets.popitem(last=False)
+            else:
+                self.client_buckets.move_to_end(key)
+            return bucket
+
+    def priority(self):
+        if request.path in CRITICAL_PATHS:
+            return PRIORITY_CRITICAL
+        if request.method in READ_METHODS or request.path in READ_PATHS:
+            return PRIORITY_READ
+        return PRIORITY_WRITE
+
+    def overload_reason(self, priority):
+        """Raison du délestage, ou None si la requête peut être admise"""
+        max_in_flight = self.config.SHED_MAX_IN_FLIGHT
+        if priority == PRIORITY_WRITE:
+            max_in_flight = max(1, int(max_in_flight * self.config.SHED_WRITE_RATIO))
+        if self.in_flight >= max_in_flight:
+            return "too many requests in flight"
+
+        stats = self.db_manager.pool_stats() if self.db_manager else None
+        if stats:
+            saturation_limit = self.config.SHED_POOL_SATURATION
+            if priority == PRIORITY_WRITE:
+                saturation_limit *= self.config.SHED_WRITE_RATIO
+            if stats['saturation'] >= saturation_limit:
+                return "database pool saturated"
+            if stats['avg_wait_ms'] >= self.config.SHED_POOL_WAIT_MS:
+                return "database pool wait too high"
+        return None
+
+    def _reject(self, status_code, message, retry_after):
+        # Refus délibéré : le taux d'erreur de /ready ne doit pas le compter
+        g.load_shed = True
+        response = jsonify({"error": message})
+        response.status_code = status_code
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
+
+    def _before_request(self):
+        if not self.enabled:
+            return None
+
+        priority = self.priority()
+        if priority == PRIORITY_CRITICAL:
+            # Les sondes ne sont ni limitées ni délestées
+            return None
+
+        reason = self.overload_reason(priority)
+        if reason:
+            self.shed_count += 1
+            logger.warning("Shedding %s %s: %s", request.method, request.path, reason)
+            return self._reject(503, f"Service overloaded: {reason}", 1)
+
+        # Les écritures laissent une réserve de jetons pour les lectures
+        reserve = self.config.RATE_LIMIT_WRITE_RESERVE if priority == PRIORITY_WRITE else 0
+        accepted, retry_after = self._client_bucket(self._client_key()).try_acquire(
+            reserve=reserve * self.config.RATE_LIMIT_CLIENT_BURST
+        )
+        if accepted:
+            accepted, retry_after = self.global_bucket.try_acquire(
+                reserve=reserve * self.config.RATE_LIMIT_GLOBAL_BURST
+            )
+        if not accepted:
+            self.limited_count += 1
+            logger.debug("Rate limited %s %s", request.method, request.path)
+            return self._reject(429, "Too many requests", retry_after)
+
+        with self.in_flight_lock:
+            self.in_flight += 1
+        g.rate_limiter_admitted = True
+        return None
+
+    def _teardown_request(self, exc):
+        if g.pop('rate_limiter_admitted', False):
+            with self.in_flight_lock:
+                self.in_flight -= 1
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "in_flight": self.in_flight,
+            "shed": self.shed_count,
+            "rate_limited": self.limited_count,
+            "tracked_clients": len(self.client_buckets)
+        }
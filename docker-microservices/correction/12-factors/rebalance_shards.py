@@ -0,0 +1,200 @@
+# rebalance_shards.py - Rééquilibrage en ligne des buckets entre shards
+#
+# Usage : DATABASE_URL=... DATABASE_SHARDS=dsn0,dsn1,dsn2 python rebalance_shards.py [--dry-run | --reconcile]
+#
+# Après l'ajout d'un shard en fin de DATABASE_SHARDS, répartit les buckets
+# uniformément. Chaque bucket est déplacé sans arrêter l'API :
+#   1. copie des lignes vers le shard cible (les écritures continuent) ;
+#   2. passage du bucket en 'moving' : les écritures de ce bucket sont refusées ;
+#   3. recopie du delta puis bascule de la carte vers le shard cible ;
+#   4. après SHARD_MAP_TTL (caches des instances expirés), purge du shard source.
+#
+# --reconcile aligne chaque shard sur l'annuaire après une écriture interrompue
+# entre les deux commits : lignes orphelines supprimées, name/email recopiés.
+import argparse
+import logging
+import sys
+import time
+from typing import Dict, List, Tuple
+from psycopg2.extras import execute_values
+from config import Config
+from sharding import BUCKET_STATE_ACTIVE, BUCKET_STATE_MOVING, ShardedPostgresEngine, connection
+
+logger = logging.getLogger(__name__)
+
+
+def plan_moves(bucket_map: Dict[int, int], shard_count: int) -> List[Tuple[int, int, int]]:
+    """Liste des déplacements (bucket, source, cible) pour équilibrer les shards"""
+    owned = {shard: [] for shard in range(shard_count)}
+    for bucket, shard in sorted(bucket_map.items()):
+        owned[shard].append(bucket)
+
+    base, extra = divmod(len(bucket_map), shard_count)
+    targets = {shard: base + (1 if shard < extra else 0) for shard in range(shard_count)}
+    surplus = []
+    for shard in range(shard_count):
+        while len(owned[shard]) > targets[shard]:
+            surplus.append((owned[shard].pop(), shard))
+
+    moves = []
+    for shard in range(shard_count):
+        while len(owned[shard]) < targets[shard]:
+            bucket, source = surplus.pop()
+            owned[shard].append(bucket)
+            moves.append((bucket, source, shard))
+    return moves
+
+
+def copy_bucket(engine: ShardedPostgresEngine, bucket: int, source: int, target: int) -> int:
+    """Copier (ou resynchroniser) les lignes d'un bucket du shard source vers la cible"""
+    with connection(engine.shards[source]) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT id, name, email, created_at FROM users WHERE id %% %s = %s",
+                (engine.bucket_count, bucket)
+            )
+            rows = cursor.fetchall()
+        conn.commit()
+
+    with connection(engine.shards[target]) as conn:
+        with conn.cursor() as cursor:
+            if rows:
+                execute_values(cursor, """
+                    INSERT INTO users (id, name, email, created_at) VALUES %s
+                    ON CONFLICT (id) DO UPDATE
+                    SET name = EXCLUDED.name, email = EXCLUDED.email, created_at = EXCLUDED.created_at
+                """, rows)
+            # Lignes supprimées à la source depuis la première copie
+            cursor.execute(
+                "DELETE FROM users WHERE id %% %s = %s AND NOT (id = ANY(%s))",
+                (engine.bucket_count, bucket, [row[0] for row in rows])
+            )
+        conn.commit()
+    return len(rows)
+
+
+def set_bucket(engine: ShardedPostgresEngine, bucket: int, shard: int, state: str):
+    with connection(engine.directory) as conn:
+        with conn.cursor() as cursor:
+            # Attend la fin des écritures en cours sur ce bucket (verrous FOR SHARE)
+            cursor.execute(
+                "UPDATE shard_buckets SET shard = %s, state = %s WHERE bucket = %s",
+                (shard, state, bucket)
+            )
+        conn.commit()
+
+
+def purge_bucket(engine: ShardedPostgresEngine, bucket: int, shard: int):
+    with connection(engine.shards[shard]) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM users WHERE id %% %s = %s", (engine.bucket_count, bucket))
+        conn.commit()
+
+
+def move_bucket(engine: ShardedPostgresEngine, bucket: int, source: int, target: int):
+    copied = copy_bucket(engine, bucket, source, target)
+    set_bucket(engine, bucket, source, BUCKET_STATE_MOVING)
+    try:
+        copied = copy_bucket(engine, bucket, source, target)
+        set_bucket(engine, bucket, target, BUCKET_STATE_ACTIVE)
+    except Exception:
+        set_bucket(engine, bucket, source, BUCKET_STATE_ACTIVE)
+        raise
+    logger.info(f"Moved bucket {bucket} from shard {source} to shard {target} ({copied} users)")
+
+
+def reconcile_bucket(engine: ShardedPostgresEngine, bucket: int) -> Tuple[int, int]:
+    """Aligner le shard propriétaire d'un bucket sur l'annuaire. Retourne (supprimés, corrigés).
+
+    Le verrou FOR UPDATE attend les écritures en cours sur le bucket (elles le
+    tiennent en FOR SHARE jusqu'au commit de l'annuaire) et bloque les suivantes
+    le temps de la comparaison : une création en cours n'est jamais prise pour
+    une orpheline.
+    """
+    with connection(engine.directory) as directory_conn:
+        try:
+            with directory_conn.cursor() as cursor:
+                cursor.execute("SELECT shard FROM shard_buckets WHERE bucket = %s FOR UPDATE", (bucket,))
+                shard = cursor.fetchone()[0]
+                cursor.execute(
+                    "SELECT id, name, email FROM user_directory WHERE id %% %s = %s",
+                    (engine.bucket_count, bucket)
+                )
+                registered = {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+
+            with connection(engine.shards[shard]) as conn:
+                try:
+                    with conn.cursor() as cursor:
+                        cursor.execute(
+                            "SELECT id, name, email FROM users WHERE id %% %s = %s",
+                            (engine.bucket_count, bucket)
+                        )
+                        stored = {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+                        orphans = [user_id for user_id in stored if user_id not in registered]
+                        stale = [
+                            user_id for user_id, identity in stored.items()
+                            if user_id in registered and identity != registered[user_id]
+                        ]
+                        if orphans:
+                            cursor.execute("DELETE FROM users WHERE id = ANY(%s)", (orphans,))
+                        for user_id in stale:
+                            name, email = registered[user_id]
+                            cursor.execute("UPDATE users SET name = %s, email = %s WHERE id = %s", (name, email, user_id))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            directory_conn.commit()
+        except Exception:
+            directory_conn.rollback()
+            raise
+    return len(orphans), len(stale)
+
+
+def reconcile(engine: ShardedPostgresEngine):
+    removed = fixed = 0
+    for bucket in sorted(engine.load_bucket_map(force=True)):
+        bucket_removed, bucket_fixed = reconcile_bucket(engine, bucket)
+        removed += bucket_removed
+        fixed += bucket_fixed
+    logger.info(f"Reconciled shards with the directory: {removed} orphan rows removed, {fixed} rows fixed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebalance user buckets across shards")
+    parser.add_argument('--dry-run', action='store_true', help="only print the planned moves")
+    parser.add_argument('--reconcile', action='store_true', help="align shard rows with the directory and exit")
+    args = parser.parse_args()
+
+    config = Config()
+    logging.basicConfig(level=getattr(logging, config.LOG_LEVEL.upper()), format=config.LOG_FORMAT)
+    if not config.DATABASE_SHARDS:
+        logger.error("DATABASE_SHARDS is not configured")
+        sys.exit(1)
+
+    engine = ShardedPostgresEngine(config)
+    engine.init_tables()
+    if args.reconcile:
+        reconcile(engine)
+        engine.close_all_connections()
+        return
+    moves = plan_moves(engine.load_bucket_map(force=True), len(engine.shards))
+    logger.info(f"{len(moves)} bucket moves planned")
+    for bucket, source, target in moves:
+        logger.info(f"  bucket {bucket}: shard {source} -> shard {target}")
+    if args.dry_run or not moves:
+        return
+
+    for bucket, source, target in moves:
+        move_bucket(engine, bucket, source, target)
+
+    # Laisser expirer les cartes en cache des instances avant de purger les sources
+    time.sleep(config.SHARD_MAP_TTL)
+    for bucket, source, _ in moves:
+        purge_bucket(engine, bucket, source)
+    logger.info("Rebalancing completed")
+    engine.close_all_connections()
+
+
+if __name__ == '__main__':
+    main()
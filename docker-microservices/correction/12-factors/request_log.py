@@ -0,0 +1,136 @@
+# request_log.py - Journal des requêtes : une ligne par requête, échantillonnée et asynchrone
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+import time
+from flask import g, request
+from config import Config
+from profiling import current_phases, timed
+from ratelimit import TokenBucket
+
+logger = logging.getLogger('request')
+
+UNMATCHED_ROUTE = '<unmatched>'
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler qui ne formate rien et ne bloque jamais le thread appelant"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # File en mémoire du même processus : le formatage est laissé au QueueListener
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        with timed('logging'):
+            super().emit(record)
+
+
+def setup_logging(config: Config) -> NonBlockingQueueHandler:
+    """Tous les logs passent par une file ; un thread dédié écrit sur stdout"""
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(config.LOG_FORMAT))
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=config.LOG_QUEUE_SIZE))
+    logging.basicConfig(
+        level=getattr(logging, config.LOG_LEVEL.upper()),
+        handlers=[queue_handler]
+    )
+    # La ligne de synthèse remplace le log d'accès du serveur de développement
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return queue_handler
+
+
+def set_rows(count: int):
+    """Nombre de lignes renvoyées par la requête en cours, repris dans la ligne de log"""
+    g.request_rows = count
+
+
+def parse_route_samples(value: str) -> dict:
+    """Parse "GET /users=0.1,GET /health=0" en {"GET /users": 0.1, ...}"""
+    samples = {}
+    for chunk in (value or '').split(','):
+        route, _, rate = chunk.strip().rpartition('=')
+        if route:
+            samples[route.strip()] = float(rate)
+    return samples
+
+
+class RequestLogger:
+    """Une ligne de synthèse par requête (route, statut, latence, lignes, attente du pool).
+
+    Les erreurs et les requêtes lentes sont toujours journalisées ; les autres sont
+    échantillonnées par route puis limitées en nombre de lignes par seconde.
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.default_sample_rate = config.REQUEST_LOG_SAMPLE_RATE
+        self.route_samples = parse_route_samples(config.REQUEST_LOG_ROUTE_SAMPLES)
+        self.slow_threshold = config.SLOW_REQUEST_MS / 1000
+        self.buckets = {}
+        self.buckets_lock = threading.Lock()
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def _before_request(self):
+        g.request_log_started = time.perf_counter()
+
+    def _allowed(self, route):
+        rate = self.route_samples.get(route, self.default_sample_rate)
+        if rate < 1 and random.random() >= rate:
+            return False
+        if self.config.REQUEST_LOG_MAX_PER_SECOND <= 0:
+            return True
+        with self.buckets_lock:
+            bucket = self.buckets.get(route)
+            if bucket is None:
+                bucket = TokenBucket(self.config.REQUEST_LOG_MAX_PER_SECOND, self.config.REQUEST_LOG_MAX_PER_SECOND)
+                self.buckets[route] = bucket
+        return bucket.try_acquire()[0]
+
+    def _after_request(self, response):
+        started = g.pop('request_log_started', None)
+        if started is None:
+            return response
+        latency = time.perf_counter() - started
+        # Libellé fixe pour les chemins inconnus : un scanner ne crée pas un seau par URL
+        route = f"{request.method} {request.url_rule.rule if request.url_rule else UNMATCHED_ROUTE}"
+        status = response.status_code
+
+        if status >= 500:
+            level = logging.ERROR
+        elif latency >= self.slow_threshold:
+            level = logging.WARNING
+        elif self._allowed(route):
+            level = logging.INFO
+        else:
+            return response
+
+        if logger.isEnabledFor(level):
+            phases = current_phases()
+            # Arguments différés : le message est formaté par le thread d'écriture
+            logger.log(
+                level,
+                "route=%s status=%d latency_ms=%.2f rows=%s pool_wait_ms=%.2f",
+                route, status, latency * 1000, g.get('request_rows', '-'),
+                phases.get('pool_wait', 0.0) * 1000
+            )
+        return response
@@ -0,0 +1,383 @@
+# sharding.py - Répartition des utilisateurs sur plusieurs instances PostgreSQL
+import heapq
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+from typing import Dict, List, Optional, Tuple
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from config import Config
+from database import PostgresEngine, TemporarilyUnavailableError
+from models import User
+from storage import StorageEngine
+
+logger = logging.getLogger(__name__)
+
+BUCKET_STATE_ACTIVE = 'active'
+BUCKET_STATE_MOVING = 'moving'
+
+
+class BucketMovingError(TemporarilyUnavailableError):
+    """Écriture refusée pendant le déplacement d'un bucket : l'API répond 503, le client peut réessayer"""
+
+
+@contextmanager
+def connection(engine: PostgresEngine):
+    conn = engine.get_connection()
+    try:
+        yield conn
+    finally:
+        engine.return_connection(conn)
+
+
+def merge_newest_first(per_shard: List[List[User]], limit: Optional[int] = None) -> List[User]:
+    """Fusionner des listes déjà triées par created_at décroissant (une par shard)"""
+    merged = heapq.merge(*per_shard, key=lambda user: user.created_at or '', reverse=True)
+    return list(islice(merged, limit))
+
+
+def row_to_user(row) -> User:
+    return User(
+        id=row['id'],
+        name=row['name'],
+        email=row['email'],
+        created_at=row['created_at'].isoformat() if row['created_at'] else None
+    )
+
+
+class ShardedPostgresEngine(StorageEngine):
+    """Utilisateurs répartis par hash de l'ID sur plusieurs bases PostgreSQL.
+
+    DATABASE_URL désigne la base annuaire qui contient :
+    - `user_directory` : allocation des IDs et unicité globale de name/email ;
+    - `shard_buckets` : carte bucket -> shard (bucket = id % SHARD_BUCKETS).
+    Chaque shard contient une table `users` sans contrainte d'unicité locale.
+
+    Annuaire et shard sont deux bases : les écritures valident le shard puis
+    l'annuaire (la suppression, l'annuaire d'abord). Une écriture interrompue
+    entre les deux commits laisse une ligne de shard orpheline, sans entrée
+    d'annuaire : les lectures l'ignorent et `rebalance_shards.py --reconcile`
+    la supprime.
+    """
+
+    name = "sharded-postgres"
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.bucket_count = config.SHARD_BUCKETS
+        self.directory = PostgresEngine(config, config.DATABASE_URL)
+        self.shards = [PostgresEngine(config, dsn) for dsn in config.DATABASE_SHARDS]
+        # Partagé par toutes les requêtes : autant de workers que de connexions
+        # disponibles sur l'ensemble des shards, pour ne pas sérialiser les requêtes
+        self.executor = ThreadPoolExecutor(
+            max_workers=len(self.shards) * config.DB_POOL_MAX_CONN, thread_name_prefix='shard'
+        )
+        self.map_lock = threading.Lock()
+        self.bucket_map: Dict[int, int] = {}
+        self.map_loaded_at = 0.0
+        logger.info(f"Sharding users over {len(self.shards)} shards ({self.bucket_count} buckets)")
+
+    # --- Carte des buckets ---
+
+    def bucket_for(self, user_id: int) -> int:
+        return user_id % self.bucket_count
+
+    def load_bucket_map(self, force: bool = False) -> Dict[int, int]:
+        with self.map_lock:
+            if not force and time.monotonic() - self.map_loaded_at < self.config.SHARD_MAP_TTL:
+                return self.bucket_map
+            with connection(self.directory) as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT bucket, shard FROM shard_buckets")
+                    self.bucket_map = dict(cursor.fetchall())
+                conn.commit()
+            self.map_loaded_at = time.monotonic()
+            return self.bucket_map
+
+    def shard_for(self, user_id: int) -> PostgresEngine:
+        """Routage des lectures ponctuelles (carte en cache, rafraîchie après SHARD_MAP_TTL)"""
+        return self.shards[self.load_bucket_map()[self.bucket_for(user_id)]]
+
+    def _lock_bucket(self, cursor, user_id: int) -> PostgresEngine:
+        """Routage des écritures : lit la carte sous verrou partagé dans la transaction annuaire"""
+        cursor.execute(
+            "SELECT shard, state FROM shard_buckets WHERE bucket = %s FOR SHARE",
+            (self.bucket_for(user_id),)
+        )
+        shard, state = cursor.fetchone()
+        if state != BUCKET_STATE_ACTIVE:
+            raise BucketMovingError(f"bucket {self.bucket_for(user_id)} is being rebalanced, retry later")
+        return self.shards[shard]
+
+    def _scatter(self, func, shards=None):
+        """Exécuter func(shard) en parallèle sur les shards"""
+        shards = self.shards if shards is None else shards
+        return list(self.executor.map(func, shards))
+
+    def _registered_ids(self, user_ids: List[int]) -> set:
+        """IDs présents dans l'annuaire, seule source de vérité sur l'existence d'un utilisateur"""
+        if not user_ids:
+            return set()
+        with connection(self.directory) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT id FROM user_directory WHERE id = ANY(%s)", (list(user_ids),))
+                registered = {row[0] for row in cursor.fetchall()}
+            conn.commit()
+        return registered
+
+    # --- Schéma ---
+
+    def init_tables(self):
+        with connection(self.directory) as conn:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("""
+                        CREATE TABLE IF NOT EXISTS user_directory (
+                            id BIGSERIAL PRIMARY KEY,
+                            name VARCHAR(50) UNIQUE NOT NULL,
+                            email VARCHAR(100) UNIQUE NOT NULL
+                        )
+                    """)
+                    cursor.execute("""
+                        CREATE TABLE IF NOT EXISTS shard_buckets (
+                            bucket INTEGER PRIMARY KEY,
+                            shard INTEGER NOT NULL,
+                            state VARCHAR(10) NOT NULL DEFAULT 'active'
+                        )
+                    """)
+                    cursor.executemany(
+                        "INSERT INTO shard_buckets (bucket, shard) VALUES (%s, %s) ON CONFLICT (bucket) DO NOTHING",
+                        [(bucket, bucket % len(self.shards)) for bucket in range(self.bucket_count)]
+                    )
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Failed to initialize shard directory: {e}")
+                raise
+
+        def init_shard(shard):
+            with connection(shard) as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("""
+                        CREATE TABLE IF NOT EXISTS users (
+                            id BIGINT PRIMARY KEY,
+                            name VARCHAR(50) NOT NULL,
+                            email VARCHAR(100) NOT NULL,
+                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        )
+                    """)
+                    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at DESC)")
+                conn.commit()
+
+        self._scatter(init_shard)
+        self.load_bucket_map(force=True)
+        logger.info("Shard directory and shard tables initialized successfully")
+
+    # --- Écritures : annuaire + shard propriétaire ---
+
+    def create_user(self, user: User) -> User:
+        with connection(self.directory) as directory_conn:
+            try:
+                with directory_conn.cursor() as cursor:
+                    cursor.execute(
+                        "INSERT INTO user_directory (name, email) VALUES (%s, %s) RETURNING id",
+                        (user.name, user.email)
+                    )
+                    user_id = cursor.fetchone()[0]
+                    shard = self._lock_bucket(cursor, user_id)
+
+                with connection(shard) as conn:
+                    try:
+                        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                            cursor.execute("""
+                                INSERT INTO users (id, name, email)
+                                VALUES (%s, %s, %s)
+                                RETURNING id, name, email,
+                                         created_at AT TIME ZONE 'UTC' as created_at
+                            """, (user_id, user.name, user.email))
+                            created_user = row_to_user(cursor.fetchone())
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+                directory_conn.commit()
+                return created_user
+
+            except psycopg2.IntegrityError as e:
+                directory_conn.rollback()
+                logger.warning(f"User creation failed - integrity constraint: {e}")
+                raise Exception(f"name or email already exists: {e}")
+            except Exception as e:
+                directory_conn.rollback()
+                logger.error(f"Failed to create user: {e}")
+                raise
+
+    def update_user(self, user_id: int, user: User) -> Optional[User]:
+        with connection(self.directory) as directory_conn:
+            try:
+                with directory_conn.cursor() as cursor:
+                    cursor.execute(
+                        "UPDATE user_directory SET name = %s, email = %s WHERE id = %s",
+                        (user.name, user.email, user_id)
+                    )
+                    if cursor.rowcount == 0:
+                        directory_conn.rollback()
+                        return None
+                    shard = self._lock_bucket(cursor, user_id)
+
+                with connection(shard) as conn:
+                    try:
+                        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                            cursor.execute("""
+                                UPDATE users
+                                SET name = %s, email = %s
+                                WHERE id = %s
+                                RETURNING id, name, email,
+                                         created_at AT TIME ZONE 'UTC' as created_at
+                            """, (user.name, user.email, user_id))
+                            result = cursor.fetchone()
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+                directory_conn.commit()
+                return row_to_user(result) if result else None
+
+            except psycopg2.IntegrityError as e:
+                directory_conn.rollback()
+                logger.warning(f"User update failed - integrity constraint: {e}")
+                raise Exception(f"name or email already exists: {e}")
+            except Exception as e:
+                directory_conn.rollback()
+                logger.error(f"Failed to update user {user_id}: {e}")
+                raise
+
+    def delete_user(self, user_id: int) -> bool:
+        with connection(self.directory) as directory_conn:
+            try:
+                with directory_conn.cursor() as cursor:
+                    cursor.execute("DELETE FROM user_directory WHERE id = %s", (user_id,))
+                    if cursor.rowcount == 0:
+                        directory_conn.rollback()
+                        return False
+                    shard = self._lock_bucket(cursor, user_id)
+                # L'annuaire d'abord : si le shard échoue, il ne reste qu'une ligne orpheline
+                directory_conn.commit()
+
+                with connection(shard) as conn:
+                    try:
+                        with conn.cursor() as cursor:
+                            cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+                        conn.commit()
+                    except Exception as e:
+                        conn.rollback()
+                        logger.warning(f"User {user_id} left orphaned on its shard: {e}")
+                return True
+
+            except Exception as e:
+                directory_conn.rollback()
+                logger.error(f"Failed to delete user {user_id}: {e}")
+                raise
+
+    # --- Lectures ---
+
+    def get_user_by_id(self, user_id: int) -> Optional[User]:
+        with connection(self.shard_for(user_id)) as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    SELECT id, name, email,
+                           created_at AT TIME ZONE 'UTC' as created_at
+                    FROM users
+                    WHERE id = %s
+                """, (user_id,))
+                result = cursor.fetchone()
+            conn.commit()
+        if not result or not self._registered_ids([user_id]):
+            return None
+        return row_to_user(result)
+
+    def get_users_by_ids(self, user_ids: List[int]) -> Tuple[List[User], List[int]]:
+        unique_ids = list(dict.fromkeys(user_ids))
+        by_shard: Dict[int, List[int]] = {}
+        bucket_map = self.load_bucket_map()
+        for user_id in unique_ids:
+            by_shard.setdefault(bucket_map[self.bucket_for(user_id)], []).append(user_id)
+
+        def fetch(item):
+            shard_index, ids = item
+            with connection(self.shards[shard_index]) as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                    cursor.execute("""
+                        SELECT id, name, email,
+                               created_at AT TIME ZONE 'UTC' as created_at
+                        FROM users
+                        WHERE id = ANY(%s)
+                    """, (ids,))
+                    rows = cursor.fetchall()
+                conn.commit()
+            return rows
+
+        found = {}
+        for rows in self.executor.map(fetch, by_shard.items()):
+            for row in rows:
+                found[row['id']] = row_to_user(row)
+        registered = self._registered_ids(list(found))
+        found = {user_id: user for user_id, user in found.items() if user_id in registered}
+        users = [found[user_id] for user_id in unique_ids if user_id in found]
+        missing = [user_id for user_id in unique_ids if user_id not in found]
+        return users, missing
+
+    def get_users(self, limit: Optional[int] = None) -> List[User]:
+        """Scatter-gather : chaque shard renvoie une liste triée, fusionnée ensuite"""
+        bucket_map = self.load_bucket_map()
+
+        def fetch(indexed_shard):
+            shard_index, shard = indexed_shard
+            # Pendant un rééquilibrage, une ligne peut exister sur deux shards :
+            # seul le propriétaire de son bucket la renvoie
+            owned = [bucket for bucket, owner in bucket_map.items() if owner == shard_index]
+            with connection(shard) as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                    cursor.execute("""
+                        SELECT id, name, email,
+                               created_at AT TIME ZONE 'UTC' as created_at
+                        FROM users
+                        WHERE id %% %s = ANY(%s)
+                        ORDER BY created_at DESC
+                        LIMIT %s
+                    """, (self.bucket_count, owned, limit))
+                    rows = cursor.fetchall()
+                conn.commit()
+            return [row_to_user(row) for row in rows]
+
+        per_shard = self._scatter(fetch, list(enumerate(self.shards)))
+        # Les lignes orphelines sont écartées ; un shard qui en a parmi ses `limit`
+        # plus récentes peut renvoyer une page un peu plus courte
+        registered = self._registered_ids([user.id for users in per_shard for user in users])
+        per_shard = [[user for user in users if user.id in registered] for users in per_shard]
+        return merge_newest_first(per_shard, limit)
+
+    def get_user_count(self) -> int:
+        """Compté dans l'annuaire : les lignes orphelines des shards n'y figurent pas"""
+        with connection(self.directory) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT COUNT(*) FROM user_directory")
+                result = cursor.fetchone()[0]
+            conn.commit()
+        return result
+
+    def health_check(self) -> bool:
+        return all([self.directory.health_check()] + self._scatter(lambda shard: shard.health_check()))
+
+    def pool_stats(self) -> dict:
+        """Le pool le plus chargé détermine la saturation"""
+        stats = [self.directory.pool_stats()] + [shard.pool_stats() for shard in self.shards]
+        return max(stats, key=lambda item: item['saturation'])
+
+    def close_all_connections(self):
+        self.executor.shutdown(wait=False)
+        for engine in [self.directory] + self.shards:
+            engine.close_all_connections()
@@ -0,0 +1,254 @@
+# storage.py - Moteurs de stockage alternatifs (mémoire, SQLite)
+import bisect
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from itertools import islice
+from typing import List, Optional, Tuple
+from models import User
+
+logger = logging.getLogger(__name__)
+
+
+class StorageEngine:
+    """Interface commune des moteurs de stockage utilisés par DatabaseManager"""
+
+    name = "abstract"
+
+    def init_tables(self):
+        raise NotImplementedError
+
+    def create_user(self, user: User) -> User:
+        raise NotImplementedError
+
+    def get_users(self, limit: Optional[int] = None) -> List[User]:
+        """Utilisateurs triés par created_at décroissant (tous si limit vaut None)"""
+        raise NotImplementedError
+
+    def get_users_by_ids(self, user_ids: List[int]) -> Tuple[List[User], List[int]]:
+        raise NotImplementedError
+
+    def get_user_by_id(self, user_id: int) -> Optional[User]:
+        raise NotImplementedError
+
+    def update_user(self, user_id: int, user: User) -> Optional[User]:
+        raise NotImplementedError
+
+    def delete_user(self, user_id: int) -> bool:
+        raise NotImplementedError
+
+    def get_user_count(self) -> int:
+        raise NotImplementedError
+
+    def health_check(self) -> bool:
+        return True
+
+    def pool_stats(self) -> Optional[dict]:
+        """Occupation du pool de connexions (None si le moteur n'a pas de pool)"""
+        return None
+
+    def close_all_connections(self):
+        pass
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+def _order_by_ids(found: dict, user_ids: List[int]) -> Tuple[List[User], List[int]]:
+    unique_ids = list(dict.fromkeys(user_ids))
+    users = [found[user_id] for user_id in unique_ids if user_id in found]
+    missing = [user_id for user_id in unique_ids if user_id not in found]
+    return users, missing
+
+
+class MemoryEngine(StorageEngine):
+    """Stockage en mémoire indexé : unicité name/email et index trié par created_at"""
+
+    name = "memory"
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.users = {}
+        self.by_name = {}
+        self.by_email = {}
+        # Liste triée de (created_at, id) : équivalent de ORDER BY created_at
+        self.by_created_at = []
+        self.next_id = 1
+
+    def init_tables(self):
+        logger.info("In-memory storage initialized")
+
+    def _check_unique(self, user: User, user_id: Optional[int] = None):
+        for index, value, field in ((self.by_name, user.name, 'name'), (self.by_email, user.email, 'email')):
+            owner = index.get(value)
+            if owner is not None and owner != user_id:
+                raise Exception(f"name or email already exists: unique constraint violated on {field}")
+
+    def _copy(self, user: User) -> User:
+        return User(id=user.id, name=user.name, email=user.email, created_at=user.created_at)
+
+    def create_user(self, user: User) -> User:
+        with self.lock:
+            self._check_unique(user)
+            created_user = User(id=self.next_id, name=user.name, email=user.email, created_at=_now())
+            self.next_id += 1
+            self.users[created_user.id] = created_user
+            self.by_name[created_user.name] = created_user.id
+            self.by_email[created_user.email] = created_user.id
+            bisect.insort(self.by_created_at, (created_user.created_at, created_user.id))
+            return self._copy(created_user)
+
+    def get_users(self, limit: Optional[int] = None) -> List[User]:
+        with self.lock:
+            newest_first = reversed(self.by_created_at)
+            return [self._copy(self.users[user_id]) for _, user_id in islice(newest_first, limit)]
+
+    def get_users_by_ids(self, user_ids: List[int]) -> Tuple[List[User], List[int]]:
+        with self.lock:
+            found = {user_id: self._copy(self.users[user_id]) for user_id in user_ids if user_id in self.users}
+        return _order_by_ids(found, user_ids)
+
+    def get_user_by_id(self, user_id: int) -> Optional[User]:
+        with self.lock:
+            user = self.users.get(user_id)
+            return self._copy(user) if user else None
+
+    def update_user(self, user_id: int, user: User) -> Optional[User]:
+        with self.lock:
+            existing = self.users.get(user_id)
+            if not existing:
+                return None
+            self._check_unique(user, user_id)
+            del self.by_name[existing.name]
+            del self.by_email[existing.email]
+            existing.name = user.name
+            existing.email = user.email
+            self.by_name[existing.name] = user_id
+            self.by_email[existing.email] = user_id
+            return self._copy(existing)
+
+    def delete_user(self, user_id: int) -> bool:
+        with self.lock:
+            user = self.users.pop(user_id, None)
+            if not user:
+                return False
+            del self.by_name[user.name]
+            del self.by_email[user.email]
+            position = bisect.bisect_left(self.by_created_at, (user.created_at, user_id))
+            del self.by_created_at[position]
+            return True
+
+    def get_user_count(self) -> int:
+        return len(self.users)
+
+
+class SQLiteEngine(StorageEngine):
+    """Stockage SQLite (fichier ou :memory:), une connexion partagée protégée par un verrou"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path or ':memory:'
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        if self.path != ':memory:':
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        logger.info(f"SQLite storage opened: {self.path}")
+
+    def _row_to_user(self, row) -> User:
+        return User(id=row['id'], name=row['name'], email=row['email'], created_at=row['created_at'])
+
+    def init_tables(self):
+        with self.lock:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name VARCHAR(50) UNIQUE NOT NULL,
+                    email VARCHAR(100) UNIQUE NOT NULL,
+                    created_at TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at);
+            """)
+            self.conn.commit()
+
+    def create_user(self, user: User) -> User:
+        with self.lock:
+            try:
+                cursor = self.conn.execute(
+                    "INSERT INTO users (name, email, created_at) VALUES (?, ?, ?)",
+                    (user.name, user.email, _now())
+                )
+                self.conn.commit()
+            except sqlite3.IntegrityError as e:
+                self.conn.rollback()
+                raise Exception(f"name or email already exists: {e}")
+            row = self.conn.execute(
+                "SELECT id, name, email, created_at FROM users WHERE id = ?", (cursor.lastrowid,)
+            ).fetchone()
+            return self._row_to_user(row)
+
+    def get_users(self, limit: Optional[int] = None) -> List[User]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, name, email, created_at FROM users ORDER BY created_at DESC LIMIT ?",
+                (-1 if limit is None else limit,)
+            ).fetchall()
+        return [self._row_to_user(row) for row in rows]
+
+    def get_users_by_ids(self, user_ids: List[int]) -> Tuple[List[User], List[int]]:
+        unique_ids = list(dict.fromkeys(user_ids))
+        if not unique_ids:
+            return [], []
+        placeholders = ','.join('?' * len(unique_ids))
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT id, name, email, created_at FROM users WHERE id IN ({placeholders})", unique_ids
+            ).fetchall()
+        return _order_by_ids({row['id']: self._row_to_user(row) for row in rows}, unique_ids)
+
+    def get_user_by_id(self, user_id: int) -> Optional[User]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT id, name, email, created_at FROM users WHERE id = ?", (user_id,)
+            ).fetchone()
+        return self._row_to_user(row) if row else None
+
+    def update_user(self, user_id: int, user: User) -> Optional[User]:
+        with self.lock:
+            try:
+                cursor = self.conn.execute(
+                    "UPDATE users SET name = ?, email = ? WHERE id = ?", (user.name, user.email, user_id)
+                )
+                self.conn.commit()
+            except sqlite3.IntegrityError as e:
+                self.conn.rollback()
+                raise Exception(f"name or email already exists: {e}")
+            if cursor.rowcount == 0:
+                return None
+        return self.get_user_by_id(user_id)
+
+    def delete_user(self, user_id: int) -> bool:
+        with self.lock:
+            cursor = self.conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+            self.conn.commit()
+            return cursor.rowcount > 0
+
+    def get_user_count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def health_check(self) -> bool:
+        try:
+            with self.lock:
+                return self.conn.execute("SELECT 1").fetchone() is not None
+        except sqlite3.Error as e:
+            logger.error(f"SQLite health check failed: {e}")
+            return False
+
+    def close_all_connections(self):
+        with self.lock:
+            self.conn.close()
+        logger.info("SQLite connection closed")
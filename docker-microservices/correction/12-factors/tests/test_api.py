@@ -29,4 +29,65 @@ class TestUserAPI:
         assert response.status_code == 200
         data = response.json()
         assert "users" in data
-        assert "count" in data
\ No newline at end of file
+        assert "count" in data
+
+    def test_get_users_negotiates_compression(self):
+        # Assez d'utilisateurs pour dépasser COMPRESSION_MIN_SIZE (1024 octets par défaut)
+        suffix = int(time.time() * 1000)
+        for i in range(20):
+            requests.post(f"{self.base_url}/users", json={
+                "name": f"gzip{suffix}_{i}", "email": f"gzip{suffix}_{i}@example.com"
+            })
+        response = requests.get(f"{self.base_url}/users", headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert len(response.content) > 1024
+        assert "Accept-Encoding" in response.headers.get("Vary", "")
+        assert response.headers.get("Content-Encoding") == "gzip"
+        assert "users" in response.json()
+
+    def test_get_users_without_accept_encoding_is_not_compressed(self):
+        response = requests.get(f"{self.base_url}/users", headers={"Accept-Encoding": "identity"})
+        assert response.status_code == 200
+        assert response.headers.get("Content-Encoding") is None
+
+    def test_batch_get_users(self):
+        user_data = {"name": "batchuser", "email": "batch@example.com"}
+        created = requests.post(f"{self.base_url}/users", json=user_data).json()
+        response = requests.get(f"{self.base_url}/users", params={"ids": f"999999,{created['id']}"})
+        assert response.status_code == 200
+        data = response.json()
+        assert [user["id"] for user in data["users"]] == [created["id"]]
+        assert data["missing"] == [999999]
+
+    def test_batch_get_users_rejects_non_object_body(self):
+        response = requests.post(f"{self.base_url}/users/batch-get", json=[1, 2])
+        assert response.status_code == 400
+
+    def test_batch_get_users_rejects_floats_and_booleans(self):
+        for ids in ([1.9], [True], ["1.5"]):
+            response = requests.post(f"{self.base_url}/users/batch-get", json={"ids": ids})
+            assert response.status_code == 400
+
+    def test_readiness_check(self):
+        response = requests.get(f"{self.base_url}/ready")
+        assert response.status_code in (200, 503)
+        data = response.json()
+        assert data["status"] in ("ready", "not ready")
+        assert "database" in data
+
+    def test_create_user_idempotency_key_replays_response(self):
+        user_data = {"name": f"idem{int(time.time())}", "email": f"idem{int(time.time())}@example.com"}
+        headers = {"Idempotency-Key": f"test-{time.time()}"}
+        first = requests.post(f"{self.base_url}/users", json=user_data, headers=headers)
+        retry = requests.post(f"{self.base_url}/users", json=user_data, headers=headers)
+        assert first.status_code == 201
+        assert retry.status_code == 201
+        assert retry.json()["id"] == first.json()["id"]
+        assert retry.headers.get("Idempotent-Replayed") == "true"
+
+    def test_get_users_limit_returns_newest_first(self):
+        response = requests.get(f"{self.base_url}/users", params={"limit": 2})
+        assert response.status_code == 200
+        users = response.json()["users"]
+        assert len(users) <= 2
+        assert [user["created_at"] for user in users] == sorted((user["created_at"] for user in users), reverse=True)
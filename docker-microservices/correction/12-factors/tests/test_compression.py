@@ -0,0 +1,71 @@
+# tests/test_compression.py - Middleware de compression sur une application Flask de test
+import gzip
+import json
+import pytest
+from flask import Flask, Response, jsonify
+from compression import Compressor, brotli, zstandard
+from config import Config
+
+ROWS = [{"id": i, "name": f"user{i}", "email": f"user{i}@example.com"} for i in range(200)]
+
+
+@pytest.fixture
+def client():
+    config = Config()
+    config.COMPRESSION_ENABLED = True
+    config.COMPRESSION_MIN_SIZE = 1024
+    app = Flask(__name__)
+    Compressor(config).init_app(app)
+
+    @app.route('/buffered')
+    def buffered():
+        return jsonify({"users": ROWS})
+
+    @app.route('/small')
+    def small():
+        return jsonify({"ok": True})
+
+    @app.route('/stream')
+    def stream():
+        def rows():
+            for row in ROWS:
+                yield json.dumps(row) + '\n'
+        return Response(rows(), mimetype='application/json')
+
+    return app.test_client()
+
+
+def test_buffered_response_is_gzip_compressed(client):
+    response = client.get('/buffered', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert json.loads(gzip.decompress(response.data))["users"] == ROWS
+
+
+def test_small_or_unrequested_responses_are_not_compressed(client):
+    assert 'Content-Encoding' not in client.get('/small', headers={'Accept-Encoding': 'gzip'}).headers
+    assert 'Content-Encoding' not in client.get('/buffered', headers={'Accept-Encoding': 'identity'}).headers
+
+
+def test_streamed_response_is_gzip_compressed(client):
+    response = client.get('/stream', headers={'Accept-Encoding': 'gzip'})
+    assert response.is_streamed
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    lines = gzip.decompress(response.data).decode('utf-8').splitlines()
+    assert [json.loads(line) for line in lines] == ROWS
+
+
+@pytest.mark.skipif(brotli is None, reason="brotli is not installed")
+def test_brotli_preferred_over_gzip(client):
+    response = client.get('/buffered', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert json.loads(brotli.decompress(response.data))["users"] == ROWS
+
+
+@pytest.mark.skipif(zstandard is None, reason="zstandard is not installed")
+def test_zstd_preferred_when_accepted(client):
+    response = client.get('/buffered', headers={'Accept-Encoding': 'gzip, br, zstd'})
+    assert response.headers['Content-Encoding'] == 'zstd'
+    body = zstandard.ZstdDecompressor().decompressobj().decompress(response.data)
+    assert json.loads(body)["users"] == ROWS
@@ -0,0 +1,56 @@
+# tests/test_sharding.py - Fonctions pures du sharding (aucune base nécessaire)
+import pytest
+
+pytest.importorskip("psycopg2")
+
+from collections import Counter
+from models import User
+from rebalance_shards import plan_moves
+from sharding import merge_newest_first
+
+
+def apply_moves(bucket_map, moves):
+    result = dict(bucket_map)
+    for bucket, source, target in moves:
+        assert result[bucket] == source
+        result[bucket] = target
+    return result
+
+
+def test_plan_moves_balanced_map_needs_no_move():
+    bucket_map = {bucket: bucket % 3 for bucket in range(12)}
+    assert plan_moves(bucket_map, 3) == []
+
+
+def test_plan_moves_spreads_buckets_onto_a_new_shard():
+    bucket_map = {bucket: bucket % 2 for bucket in range(12)}
+    moves = plan_moves(bucket_map, 3)
+    assert len(moves) == 4
+    assert all(target == 2 for _, _, target in moves)
+    assert sorted(Counter(apply_moves(bucket_map, moves).values()).values()) == [4, 4, 4]
+
+
+def test_plan_moves_uneven_bucket_count():
+    bucket_map = {bucket: 0 for bucket in range(10)}
+    moves = plan_moves(bucket_map, 3)
+    # Aucun bucket n'est déplacé deux fois et chaque shard reçoit 3 ou 4 buckets
+    assert len({bucket for bucket, _, _ in moves}) == len(moves)
+    assert sorted(Counter(apply_moves(bucket_map, moves).values()).values()) == [3, 3, 4]
+
+
+def user(user_id, created_at):
+    return User(id=user_id, name=f"user{user_id}", email=f"user{user_id}@example.com", created_at=created_at)
+
+
+def test_merge_newest_first_interleaves_shards():
+    shard0 = [user(4, '2024-01-04T00:00:00'), user(1, '2024-01-01T00:00:00')]
+    shard1 = [user(3, '2024-01-03T00:00:00'), user(2, '2024-01-02T00:00:00')]
+    assert [u.id for u in merge_newest_first([shard0, shard1])] == [4, 3, 2, 1]
+
+
+def test_merge_newest_first_applies_limit_and_handles_empty_shards():
+    shard0 = [user(5, '2024-02-01T00:00:00'), user(2, '2024-01-02T00:00:00')]
+    shard1 = []
+    shard2 = [user(4, '2024-01-20T00:00:00')]
+    assert [u.id for u in merge_newest_first([shard0, shard1, shard2], limit=2)] == [5, 4]
+    assert merge_newest_first([[], []], limit=5) == []
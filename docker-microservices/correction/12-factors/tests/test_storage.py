@@ -0,0 +1,73 @@
+# tests/test_storage.py - Moteurs mémoire et SQLite (aucun serveur ni PostgreSQL nécessaire)
+import pytest
+from models import User
+from storage import MemoryEngine, SQLiteEngine
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def engine(request):
+    engine = MemoryEngine() if request.param == "memory" else SQLiteEngine(":memory:")
+    engine.init_tables()
+    yield engine
+    engine.close_all_connections()
+
+
+def create(engine, name):
+    return engine.create_user(User(name=name, email=f"{name}@example.com"))
+
+
+def test_create_and_get_user(engine):
+    created = create(engine, "alice")
+    assert created.id is not None
+    assert created.created_at is not None
+    assert engine.get_user_by_id(created.id) == created
+    assert engine.get_user_by_id(created.id + 1000) is None
+    assert engine.get_user_count() == 1
+
+
+def test_get_users_newest_first_with_limit(engine):
+    for i in range(5):
+        create(engine, f"user{i}")
+    users = engine.get_users()
+    assert len(users) == 5
+    assert [user.created_at for user in users] == sorted((user.created_at for user in users), reverse=True)
+    limited = engine.get_users(limit=2)
+    assert [user.id for user in limited] == [user.id for user in users[:2]]
+
+
+def test_create_user_rejects_duplicate_name_or_email(engine):
+    create(engine, "bob")
+    with pytest.raises(Exception, match="already exists"):
+        engine.create_user(User(name="bob", email="other@example.com"))
+    with pytest.raises(Exception, match="already exists"):
+        engine.create_user(User(name="other", email="bob@example.com"))
+    assert engine.get_user_count() == 1
+
+
+def test_update_user_checks_uniqueness_and_frees_old_values(engine):
+    carol = create(engine, "carol")
+    dave = create(engine, "dave")
+    with pytest.raises(Exception, match="already exists"):
+        engine.update_user(dave.id, User(name="carol", email="dave@example.com"))
+    updated = engine.update_user(carol.id, User(name="caroline", email="caroline@example.com"))
+    assert updated.name == "caroline"
+    # L'ancien nom est libéré
+    assert create(engine, "carol").name == "carol"
+    assert engine.update_user(9999, User(name="x", email="x@example.com")) is None
+
+
+def test_delete_user(engine):
+    erin = create(engine, "erin")
+    assert engine.delete_user(erin.id) is True
+    assert engine.delete_user(erin.id) is False
+    assert engine.get_user_by_id(erin.id) is None
+    assert engine.get_users() == []
+    assert create(engine, "erin").name == "erin"
+
+
+def test_get_users_by_ids_keeps_request_order_and_reports_missing(engine):
+    first, second, third = (create(engine, name) for name in ("frank", "grace", "heidi"))
+    users, missing = engine.get_users_by_ids([third.id, 9999, first.id, third.id, 8888])
+    assert [user.id for user in users] == [third.id, first.id]
+    assert missing == [9999, 8888]
+    assert second.id not in [user.id for user in users]
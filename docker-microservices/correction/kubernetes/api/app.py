@@ -1,17 +1,163 @@
-from flask import Flask, jsonify
+from flask import Flask, jsonify, g, request, Response
 import os
+import signal
+import threading
 import time
 
 app = Flask(__name__)
 
+# Capacité de traitement : les requêtes au-delà attendent dans la file
+MAX_CONCURRENCY = int(os.getenv('MAX_CONCURRENCY', 6))
+# Taille maximale de la file et attente maximale d'un slot : au-delà, réponse 503
+MAX_QUEUE = int(os.getenv('MAX_QUEUE', 12))
+QUEUE_TIMEOUT = float(os.getenv('QUEUE_TIMEOUT', 2))
+# Délai laissé à Kubernetes pour retirer le pod des endpoints après le passage en "not ready"
+DRAIN_DELAY = float(os.getenv('DRAIN_DELAY', 5))
+# Temps maximum d'attente de la fin des requêtes en cours
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', 30))
+
+# Les sondes et les métriques ne passent pas par la file
+UNMETERED_PATHS = {'/health', '/ready', '/metrics', '/drain'}
+
+
+class LoadTracker:
+    """Compteurs de charge exposés à l'autoscaler"""
+
+    def __init__(self, max_concurrency, max_queue, queue_timeout):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.queued = 0
+        self.requests_total = 0
+        self.rejected_total = 0
+        self.draining = threading.Event()
+        self.idle = threading.Condition(self.lock)
+
+    def enter(self):
+        """Attendre un slot. Retourne False si la file est pleine ou l'attente trop longue.
+
+        La file est bornée : un thread du serveur bloqué ici ne sert plus les
+        sondes, il en reste donc toujours assez (voir gunicorn.conf.py).
+        """
+        with self.lock:
+            if self.queued >= self.max_queue:
+                self.rejected_total += 1
+                return False
+            self.queued += 1
+        acquired = self.slots.acquire(timeout=self.queue_timeout)
+        with self.lock:
+            self.queued -= 1
+            if not acquired:
+                self.rejected_total += 1
+                if self.in_flight == 0 and self.queued == 0:
+                    self.idle.notify_all()
+                return False
+            self.in_flight += 1
+            self.requests_total += 1
+        return True
+
+    def leave(self):
+        self.slots.release()
+        with self.lock:
+            self.in_flight -= 1
+            if self.in_flight == 0 and self.queued == 0:
+                self.idle.notify_all()
+
+    def utilization(self):
+        """(en cours + en attente) / capacité : > 1 signifie que des requêtes attendent"""
+        return (self.in_flight + self.queued) / self.max_concurrency
+
+    def drain(self):
+        """Passer en "not ready", puis attendre la fin des requêtes en cours"""
+        if self.draining.is_set():
+            return self.in_flight + self.queued == 0
+        self.draining.set()
+        time.sleep(DRAIN_DELAY)
+        with self.lock:
+            return self.idle.wait_for(lambda: self.in_flight == 0 and self.queued == 0, timeout=DRAIN_TIMEOUT)
+
+
+tracker = LoadTracker(MAX_CONCURRENCY, MAX_QUEUE, QUEUE_TIMEOUT)
+
+
+# Le hook preStop appelle /drain depuis le pod lui-même
+LOOPBACK_ADDRESSES = {'127.0.0.1', '::1'}
+
+
+@app.before_request
+def admit_request():
+    if request.path not in UNMETERED_PATHS:
+        if not tracker.enter():
+            response = jsonify({'error': 'Server busy, retry later', 'queued': tracker.queued})
+            response.status_code = 503
+            response.headers['Retry-After'] = '1'
+            return response
+        g.metered = True
+
+@app.teardown_request
+def release_request(exc):
+    if g.pop('metered', False):
+        tracker.leave()
+
 @app.route('/health')
 def health():
+    """Liveness : le processus répond"""
     return jsonify({
         'status': 'healthy',
         'environment': os.getenv('ENVIRONMENT', 'development'),
         'timestamp': time.time()
     })
 
+@app.route('/ready')
+def ready():
+    """Readiness : passe à 503 dès le début du drain"""
+    if tracker.draining.is_set():
+        return jsonify({'status': 'draining', 'in_flight': tracker.in_flight}), 503
+    return jsonify({'status': 'ready', 'utilization': round(tracker.utilization(), 3)})
+
+@app.route('/metrics')
+def metrics():
+    """Métriques au format Prometheus, consommées par l'HPA via prometheus-adapter"""
+    lines = [
+        '# HELP api_inflight_requests Requests currently being processed',
+        '# TYPE api_inflight_requests gauge',
+        f'api_inflight_requests {tracker.in_flight}',
+        '# HELP api_queue_depth Requests waiting for a processing slot',
+        '# TYPE api_queue_depth gauge',
+        f'api_queue_depth {tracker.queued}',
+        '# HELP api_rejected_total Requests rejected because the queue was full or the wait too long',
+        '# TYPE api_rejected_total counter',
+        f'api_rejected_total {tracker.rejected_total}',
+        '# HELP api_max_queue Queue capacity of this pod',
+        '# TYPE api_max_queue gauge',
+        f'api_max_queue {tracker.max_queue}',
+        '# HELP api_utilization (in-flight + queued) / max concurrency',
+        '# TYPE api_utilization gauge',
+        f'api_utilization {tracker.utilization():.3f}',
+        '# HELP api_max_concurrency Processing slots of this pod',
+        '# TYPE api_max_concurrency gauge',
+        f'api_max_concurrency {tracker.max_concurrency}',
+        '# HELP api_draining 1 while the pod is draining',
+        '# TYPE api_draining gauge',
+        f'api_draining {1 if tracker.draining.is_set() else 0}',
+        '# HELP api_requests_total Requests processed since start',
+        '# TYPE api_requests_total counter',
+        f'api_requests_total {tracker.requests_total}',
+    ]
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+@app.route('/drain', methods=['POST'])
+def drain():
+    """Appelé par le hook preStop : rend la main une fois le pod vidé"""
+    if request.remote_addr not in LOOPBACK_ADDRESSES:
+        # Sans cette restriction, n'importe quel client du Service sortirait le pod du trafic
+        return jsonify({'error': 'Forbidden'}), 403
+    drained = tracker.drain()
+    return jsonify({'status': 'drained' if drained else 'timeout', 'in_flight': tracker.in_flight}), 200 if drained else 504
+
 @app.route('/api/users')
 def users():
     return jsonify({
@@ -22,5 +168,13 @@ def users():
         'environment': os.getenv('ENVIRONMENT', 'development')
     })
 
+def handle_sigterm(signum, frame):
+    """Arrêt gracieux hors gunicorn : drain puis sortie"""
+    def shutdown():
+        tracker.drain()
+        os._exit(0)
+    threading.Thread(target=shutdown, daemon=True).start()
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=os.getenv('DEBUG', 'False') == 'True')
\ No newline at end of file
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    app.run(host='0.0.0.0', port=5000, debug=os.getenv('DEBUG', 'False') == 'True', threaded=True)
@@ -0,0 +1,14 @@
+# gunicorn.conf.py - Un seul processus (compteurs de charge exacts), threads dimensionnés sur la file
+import os
+
+bind = '0.0.0.0:5000'
+workers = 1
+worker_class = 'gthread'
+# Slots de traitement + file bornée + threads réservés : quand la file est pleine,
+# les requêtes sont refusées (503) et les sondes /health, /ready et /metrics restent servies
+threads = (
+    int(os.getenv('MAX_CONCURRENCY', 6))
+    + int(os.getenv('MAX_QUEUE', 12))
+    + int(os.getenv('PROBE_THREADS', 4))
+)
+graceful_timeout = 30
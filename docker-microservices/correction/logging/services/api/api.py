@@ -1,12 +1,29 @@
+import atexit
 import json
 import logging.handlers
+import os
+import random
+import signal
 import socket
+import sys
+import threading
 import time
-from flask import Flask, request, jsonify
+from collections import Counter
+from flask import Flask, request, jsonify, g, has_request_context
 from datetime import datetime
 
 app = Flask(__name__)
 
+# Agrégation des logs : toutes les requêtes sont résumées par intervalle,
+# les avertissements, erreurs et requêtes lentes partent en plus individuellement
+ROLLUP_INTERVAL = float(os.getenv('LOG_ROLLUP_INTERVAL', 60))
+SLOW_REQUEST_MS = float(os.getenv('LOG_SLOW_REQUEST_MS', 500))
+# Nombre maximum de latences conservées par route et par intervalle pour les percentiles
+ROLLUP_SAMPLE_SIZE = int(os.getenv('LOG_ROLLUP_SAMPLE_SIZE', 1000))
+
+# Attributs standards d'un LogRecord : tout le reste vient de `extra`
+STANDARD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
 # Configuration logging vers Logstash
 class LogstashFormatter(logging.Formatter):
     def format(self, record):
@@ -22,16 +39,122 @@ class LogstashFormatter(logging.Formatter):
             "user_id": getattr(record, 'user_id', None),
             "execution_time": getattr(record, 'execution_time', None)
         }
-        return json.dumps(log_entry)
+        for key, value in vars(record).items():
+            if key not in STANDARD_ATTRIBUTES and key not in log_entry:
+                log_entry[key] = value
+        return json.dumps(log_entry, default=str)
+
+class JSONLinesSocketHandler(logging.handlers.SocketHandler):
+    """Envoie chaque log formaté sur une ligne JSON (codec json_lines de Logstash)"""
+
+    def makePickle(self, record):
+        return (self.format(record) + '\n').encode('utf-8')
+
+class RequestContextFilter(logging.Filter):
+    """Retient les logs INFO/DEBUG émis pendant une requête.
+
+    Ils ne sont envoyés que si la requête est transmise individuellement
+    (erreur, avertissement, lenteur), dans le champ `context` du document.
+    """
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not has_request_context():
+            return True
+        if getattr(record, 'doc_type', None):
+            return True
+        g.setdefault('log_context', []).append(record.getMessage())
+        return False
+
+class RequestRollup:
+    """Agrège les requêtes par route et émet un document par intervalle"""
+
+    def __init__(self, interval, sample_size):
+        self.interval = interval
+        self.sample_size = sample_size
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.started_at = time.time()
+        self.stop_event = threading.Event()
+
+    def record(self, method, route, status_code, execution_time):
+        with self.lock:
+            stats = self.routes.setdefault((method, route), {
+                "count": 0, "total_ms": 0.0, "max_ms": 0.0, "samples": [], "status_codes": Counter()
+            })
+            stats["count"] += 1
+            stats["total_ms"] += execution_time
+            stats["max_ms"] = max(stats["max_ms"], execution_time)
+            stats["status_codes"][str(status_code)] += 1
+            # Échantillonnage par réservoir : mémoire bornée, percentiles représentatifs
+            if len(stats["samples"]) < self.sample_size:
+                stats["samples"].append(execution_time)
+            else:
+                index = random.randrange(stats["count"])
+                if index < self.sample_size:
+                    stats["samples"][index] = execution_time
+
+    @staticmethod
+    def percentile(sorted_samples, fraction):
+        if not sorted_samples:
+            return None
+        index = min(len(sorted_samples) - 1, int(round(fraction * (len(sorted_samples) - 1))))
+        return round(sorted_samples[index], 2)
+
+    def flush(self):
+        with self.lock:
+            routes, self.routes = self.routes, {}
+            started_at, self.started_at = self.started_at, time.time()
+        for (method, route), stats in routes.items():
+            samples = sorted(stats["samples"])
+            logger.info("HTTP Rollup", extra={
+                'doc_type': 'rollup',
+                'method': method,
+                'route': route,
+                'count': stats["count"],
+                'interval_start': datetime.utcfromtimestamp(started_at).isoformat(),
+                'interval_seconds': round(time.time() - started_at, 1),
+                'execution_time': round(stats["total_ms"] / stats["count"], 2),
+                'latency_avg': round(stats["total_ms"] / stats["count"], 2),
+                'latency_p50': self.percentile(samples, 0.50),
+                'latency_p90': self.percentile(samples, 0.90),
+                'latency_p99': self.percentile(samples, 0.99),
+                'latency_max': round(stats["max_ms"], 2),
+                'status_codes': dict(stats["status_codes"])
+            })
+
+    def start(self):
+        def run():
+            while not self.stop_event.wait(self.interval):
+                self.flush()
+        threading.Thread(target=run, name='log-rollup', daemon=True).start()
+
+    def stop(self):
+        """Arrêter le thread et émettre l'intervalle en cours : rien n'est perdu à l'arrêt"""
+        self.stop_event.set()
+        self.flush()
 
 # Setup logger
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 # Handler vers Logstash
-logstash_handler = logging.handlers.SocketHandler('logstash', 5000)
+logstash_handler = JSONLinesSocketHandler('logstash', 5000)
 logstash_handler.setFormatter(LogstashFormatter())
+logstash_handler.addFilter(RequestContextFilter())
 logger.addHandler(logstash_handler)
+# Le log d'accès du serveur ferait un document par requête : il est remplacé par les synthèses
+logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+rollup = RequestRollup(ROLLUP_INTERVAL, ROLLUP_SAMPLE_SIZE)
+rollup.start()
+# Enregistré après logging : exécuté avant logging.shutdown, le handler Logstash est encore ouvert
+atexit.register(rollup.stop)
+
+def handle_sigterm(signum, frame):
+    # SIGTERM (docker stop, déploiement) tuerait le processus sans exécuter atexit
+    sys.exit(0)
+
+signal.signal(signal.SIGTERM, handle_sigterm)
 
 @app.before_request
 def before_request():
@@ -40,14 +163,32 @@ def before_request():
 
 @app.after_request
 def after_request(response):
-    duration = time.time() - request.start_time
-    logger.info("HTTP Request", extra={
+    duration = round((time.time() - request.start_time) * 1000, 2)
+    route = request.url_rule.rule if request.url_rule else '<unmatched>'
+
+    # Toutes les requêtes entrent dans la synthèse : compteurs et percentiles
+    # couvrent aussi les erreurs et la traîne des requêtes lentes
+    rollup.record(request.method, route, response.status_code, duration)
+
+    if response.status_code >= 500:
+        level = logging.ERROR
+    elif response.status_code >= 400 or duration >= SLOW_REQUEST_MS:
+        level = logging.WARNING
+    else:
+        # Succès rapide : seulement dans le prochain document de synthèse
+        return response
+
+    logger.log(level, "HTTP Request", extra={
+        'doc_type': 'request',
         'request_id': request.request_id,
         'method': request.method,
+        'route': route,
         'url': request.url,
         'status_code': response.status_code,
-        'execution_time': round(duration * 1000, 2),
-        'ip': request.remote_addr
+        'execution_time': duration,
+        'slow': duration >= SLOW_REQUEST_MS,
+        'ip': request.remote_addr,
+        'context': g.get('log_context', [])
     })
     return response
 
@@ -68,23 +209,23 @@ def get_users():
 def get_user(user_id):
     try:
         logger.info(f"Fetching user {user_id}", extra={
-            'request_id': request.request_id, 
+            'request_id': request.request_id,
             'user_id': user_id
         })
-        
+
         if user_id > 10:
             logger.warning(f"User {user_id} not found", extra={
                 'request_id': request.request_id,
                 'user_id': user_id
             })
             return jsonify({"error": "User not found"}), 404
-            
+
         if user_id == 999:
             # Simulation d'erreur
             raise Exception("Database connection failed")
-            
+
         return jsonify({"id": user_id, "name": f"User{user_id}", "email": f"user{user_id}@test.com"})
-        
+
     except Exception as e:
         logger.error(f"Error fetching user {user_id}: {str(e)}", extra={
             'request_id': request.request_id,
@@ -94,4 +235,4 @@ def get_user(user_id):
 
 if __name__ == '__main__':
     logger.info("API Service starting up")
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5000)
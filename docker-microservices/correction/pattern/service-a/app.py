@@ -1,9 +1,16 @@
-from flask import Flask, jsonify, render_template_string
+from flask import Flask, g, jsonify, render_template_string, request
+import hmac
+import os
 import requests
+import sys
+import threading
 import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 from threading import Lock
 from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
 
 app = Flask(__name__)
 
@@ -12,6 +19,9 @@ class CircuitState(Enum):
     OPEN = "open"          # Circuit ouvert, pas d'appels
     HALF_OPEN = "half_open"  # Test de récupération
 
+class CircuitOpenError(Exception):
+    """Levée quand le circuit est ouvert et qu'aucun appel n'est tenté"""
+
 class CircuitBreaker:
     def __init__(self, failure_threshold=3, timeout=10, recovery_timeout=30):
         self.failure_threshold = failure_threshold
@@ -21,6 +31,8 @@ class CircuitBreaker:
         self.failure_count = 0
         self.last_failure_time = None
         self.state = CircuitState.CLOSED
+        # En HALF_OPEN, un seul appel d'essai à la fois vers le service qui récupère
+        self.probe_in_flight = False
         self.lock = Lock()
     
     def call(self, func, *args, **kwargs):
@@ -30,15 +42,28 @@ class CircuitBreaker:
                 if self._should_attempt_reset():
                     self.state = CircuitState.HALF_OPEN
                 else:
-                    raise Exception("Circuit breaker is OPEN")
-            
-            try:
-                result = func(*args, **kwargs)
-                self._on_success()
-                return result
-            except Exception as e:
+                    raise CircuitOpenError("Circuit breaker is OPEN")
+            is_probe = self.state == CircuitState.HALF_OPEN
+            if is_probe:
+                if self.probe_in_flight:
+                    # Les autres requêtes sont refusées (et servies depuis le cache)
+                    raise CircuitOpenError("Circuit breaker is HALF_OPEN, recovery probe in progress")
+                self.probe_in_flight = True
+        
+        # L'appel se fait hors du verrou : les appels indépendants peuvent être concurrents
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            with self.lock:
+                if is_probe:
+                    self.probe_in_flight = False
                 self._on_failure()
-                raise e
+            raise e
+        with self.lock:
+            if is_probe:
+                self.probe_in_flight = False
+            self._on_success()
+        return result
     
     def _should_attempt_reset(self):
         """Vérifie s'il faut tenter une récupération"""
@@ -56,21 +81,103 @@ class CircuitBreaker:
         self.failure_count += 1
         self.last_failure_time = datetime.now()
         
-        if self.failure_count >= self.failure_threshold:
+        # Un essai raté en HALF_OPEN rouvre le circuit pour un nouveau délai
+        if self.state == CircuitState.HALF_OPEN or self.failure_count >= self.failure_threshold:
             self.state = CircuitState.OPEN
 
 # Instance globale du circuit breaker
 circuit_breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=20)
 
-SERVICE_B_URL = "http://service-b:5001"
+SERVICE_B_URL = os.environ.get("SERVICE_B_URL", "http://service-b:5001")
+
+# Session partagée : connexions keep-alive réutilisées vers le service B
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=int(os.environ.get("HTTP_POOL_SIZE", 10))))
+
+# Threads pour les appels parallèles et les rafraîchissements en arrière-plan
+executor = ThreadPoolExecutor(max_workers=int(os.environ.get("UPSTREAM_WORKERS", 8)))
 
 def call_service_b(endpoint):
     """Fonction pour appeler le service B"""
-    response = requests.get(f"{SERVICE_B_URL}{endpoint}", timeout=circuit_breaker.timeout)
+    response = session.get(f"{SERVICE_B_URL}{endpoint}", timeout=circuit_breaker.timeout)
     if response.status_code != 200:
         raise Exception(f"HTTP {response.status_code}")
     return response.json()
 
+class ResponseCache:
+    """Cache stale-while-revalidate des réponses du service B.
+
+    - réponse de moins de `ttl` secondes : servie directement ;
+    - plus ancienne : servie (marquée stale) pendant qu'un rafraîchissement
+      tourne en arrière-plan ;
+    - circuit ouvert ou appel en échec : la dernière réponse connue est
+      servie (marquée stale) tant qu'elle a moins de `max_stale` secondes.
+    """
+
+    def __init__(self, ttl=5, max_stale=300):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.entries = {}
+        self.refreshing = set()
+        self.lock = Lock()
+
+    def _fetch(self, endpoint):
+        data = circuit_breaker.call(call_service_b, endpoint)
+        with self.lock:
+            self.entries[endpoint] = (data, time.monotonic())
+        return data
+
+    def _refresh(self, endpoint):
+        try:
+            self._fetch(endpoint)
+        except Exception:
+            pass
+        finally:
+            with self.lock:
+                self.refreshing.discard(endpoint)
+
+    def get(self, endpoint):
+        """Retourne (données, stale). Lève l'erreur amont si rien d'utilisable n'est en cache"""
+        with self.lock:
+            entry = self.entries.get(endpoint)
+        if entry:
+            data, fetched_at = entry
+            age = time.monotonic() - fetched_at
+            if age < self.ttl:
+                return data, False
+            if age < self.max_stale:
+                with self.lock:
+                    start_refresh = endpoint not in self.refreshing
+                    self.refreshing.add(endpoint)
+                if start_refresh:
+                    executor.submit(self._refresh, endpoint)
+                return data, True
+        try:
+            return self._fetch(endpoint), False
+        except Exception:
+            with self.lock:
+                entry = self.entries.get(endpoint)
+            if entry and time.monotonic() - entry[1] < self.max_stale:
+                return entry[0], True
+            raise
+
+    def get_many(self, endpoints):
+        """Interroge plusieurs ressources indépendantes en parallèle"""
+        futures = {endpoint: executor.submit(self.get, endpoint) for endpoint in endpoints}
+        results = {}
+        for endpoint, future in futures.items():
+            try:
+                data, stale = future.result()
+                results[endpoint] = {"data": data, "stale": stale}
+            except Exception as e:
+                results[endpoint] = {"error": str(e)}
+        return results
+
+response_cache = ResponseCache(
+    ttl=float(os.environ.get("CACHE_TTL", 5)),
+    max_stale=float(os.environ.get("CACHE_MAX_STALE", 300))
+)
+
 @app.route('/')
 def dashboard():
     """Dashboard avec état du circuit breaker"""
@@ -101,6 +208,7 @@ def dashboard():
         
         <button onclick="location.href='/test-api'">Tester API</button>
         <button onclick="location.href='/health-status'">Vérifier Santé</button>
+        <button onclick="location.href='/overview'">Vue d'ensemble</button>
         <button onclick="location.reload()">Actualiser</button>
         
         {% if error %}
@@ -129,10 +237,10 @@ def dashboard():
 
 @app.route('/test-api')
 def test_api():
-    """Test de l'API à travers le circuit breaker"""
+    """Test de l'API à travers le circuit breaker (avec repli sur le cache)"""
     try:
-        data = circuit_breaker.call(call_service_b, '/api/data')
-        return dashboard_with_data(data=data)
+        data, stale = response_cache.get('/api/data')
+        return dashboard_with_data(data=data, stale=stale)
     except Exception as e:
         return dashboard_with_data(error=str(e))
 
@@ -140,12 +248,21 @@ def test_api():
 def health_status():
     """Vérification de l'état de santé"""
     try:
-        health_data = circuit_breaker.call(call_service_b, '/health')
-        return dashboard_with_data(data=health_data)
+        health_data, stale = response_cache.get('/health')
+        return dashboard_with_data(data=health_data, stale=stale)
     except Exception as e:
         return dashboard_with_data(error=str(e))
 
-def dashboard_with_data(data=None, error=None):
+@app.route('/overview')
+def overview():
+    """Données et santé du service B, récupérées en parallèle"""
+    results = response_cache.get_many(['/api/data', '/health'])
+    errors = [f"{endpoint}: {result['error']}" for endpoint, result in results.items() if 'error' in result]
+    data = {endpoint: result['data'] for endpoint, result in results.items() if 'data' in result}
+    stale = any(result.get('stale') for result in results.values())
+    return dashboard_with_data(data=data or None, error='; '.join(errors) or None, stale=stale)
+
+def dashboard_with_data(data=None, error=None, stale=False):
     """Dashboard avec données ou erreur"""
     html = """
     <!DOCTYPE html>
@@ -160,6 +277,7 @@ def dashboard_with_data(data=None, error=None):
             .half-open { background-color: #fff3cd; color: #856404; }
             .error { background-color: #f8d7da; color: #721c24; margin-top: 10px; }
             .success { background-color: #d4edda; color: #155724; margin-top: 10px; }
+            .stale { background-color: #fff3cd; color: #856404; margin-top: 10px; }
             button { padding: 10px; margin: 5px; font-size: 16px; }
             pre { background: #f8f9fa; padding: 10px; border-radius: 3px; }
         </style>
@@ -176,6 +294,7 @@ def dashboard_with_data(data=None, error=None):
         <button onclick="location.href='/'">Retour</button>
         <button onclick="location.href='/test-api'">Tester API</button>
         <button onclick="location.href='/health-status'">Vérifier Santé</button>
+        <button onclick="location.href='/overview'">Vue d'ensemble</button>
         
         {% if error %}
         <div class="error">
@@ -183,7 +302,12 @@ def dashboard_with_data(data=None, error=None):
         </div>
         {% endif %}
         
-        {% if data %}
+        {% if data and stale %}
+        <div class="stale">
+            <strong>Données en cache (potentiellement obsolètes):</strong>
+            <pre>{{ data }}</pre>
+        </div>
+        {% elif data %}
         <div class="success">
             <strong>Succès! Données reçues:</strong>
             <pre>{{ data }}</pre>
@@ -201,7 +325,8 @@ def dashboard_with_data(data=None, error=None):
         failure_threshold=circuit_breaker.failure_threshold,
         timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
         data=json.dumps(data, indent=2) if data else None,
-        error=error
+        error=error,
+        stale=stale
     )
 
 @app.route('/health')
@@ -216,5 +341,91 @@ def health():
         }
     })
 
+# --- Profilage à la demande : /debug/profile et /debug/slow ---
+# Protégés par X-Debug-Token si DEBUG_TOKEN est défini, sinon accessibles en local uniquement
+DEBUG_TOKEN = os.environ.get("DEBUG_TOKEN", "")
+LOOPBACK_ADDRESSES = {"127.0.0.1", "::1"}
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", 30))
+PROFILE_INTERVAL = 0.005
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", 500))
+
+profile_lock = Lock()
+slow_requests = deque(maxlen=int(os.environ.get("SLOW_REQUEST_BUFFER", 50)))
+slow_requests_lock = Lock()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_slow_request(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        duration_ms = (time.perf_counter() - started) * 1000
+        if duration_ms >= SLOW_REQUEST_MS:
+            with slow_requests_lock:
+                slow_requests.append({
+                    "method": request.method,
+                    "path": request.path,
+                    "status": response.status_code,
+                    "duration_ms": round(duration_ms, 2),
+                    "timestamp": time.time()
+                })
+    return response
+
+def debug_allowed():
+    """Jeton X-Debug-Token si DEBUG_TOKEN est défini, sinon requêtes locales uniquement"""
+    if DEBUG_TOKEN:
+        return hmac.compare_digest(request.headers.get("X-Debug-Token", ""), DEBUG_TOKEN)
+    return request.remote_addr in LOOPBACK_ADDRESSES
+
+def collapse_stack(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+@app.route('/debug/profile')
+def debug_profile():
+    """Profil par échantillonnage de tous les threads, au format "piles repliées" """
+    if not debug_allowed():
+        return jsonify({"error": "Forbidden"}), 403
+    try:
+        seconds = float(request.args.get("seconds", 5))
+    except ValueError:
+        return jsonify({"error": "seconds must be a number"}), 400
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        return jsonify({"error": f"seconds must be between 0 and {PROFILE_MAX_SECONDS:g}"}), 400
+    if not profile_lock.acquire(blocking=False):
+        return jsonify({"error": "A profile is already running"}), 409
+    try:
+        samples = Counter()
+        current = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != current:
+                    samples[collapse_stack(frame)] += 1
+            time.sleep(PROFILE_INTERVAL)
+    finally:
+        profile_lock.release()
+    body = "\n".join(f"{stack} {count}" for stack, count in samples.most_common()) + "\n"
+    return body, 200, {"Content-Type": "text/plain; charset=utf-8"}
+
+@app.route('/debug/slow')
+def debug_slow():
+    """Requêtes récentes les plus lentes"""
+    if not debug_allowed():
+        return jsonify({"error": "Forbidden"}), 403
+    limit = request.args.get("limit", type=int)
+    with slow_requests_lock:
+        entries = sorted(slow_requests, key=lambda entry: entry["duration_ms"], reverse=True)
+    return jsonify({
+        "threshold_ms": SLOW_REQUEST_MS,
+        "requests": entries[:limit] if limit else entries
+    })
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5002, debug=True)
\ No newline at end of file
@@ -1,7 +1,13 @@
-from flask import Flask, jsonify
+from flask import Flask, Response, g, jsonify, request
+import hmac
+import os
 import requests
+import sys
+import threading
 import time
+from collections import Counter, deque
 from datetime import datetime
+from threading import Lock
 
 app = Flask(__name__)
 
@@ -32,12 +38,28 @@ def health_check():
     
     return jsonify(health_status)
 
+# En-têtes de la réponse amont recopiés tels quels vers le client
+PASSTHROUGH_HEADERS = ('Content-Type', 'Content-Encoding', 'Content-Length', 'Vary', 'Cache-Control', 'ETag')
+
 @app.route('/api/data')
 def proxy_data():
-    """Proxy vers le service C"""
+    """Proxy vers le service C : les octets amont sont relayés sans décodage ni ré-encodage"""
     try:
-        response = requests.get(f"{SERVICE_C_URL}/data", timeout=3)
-        return response.json(), response.status_code
+        # Sans en-tête client, requests enverrait "gzip, deflate" par défaut :
+        # un corps compressé serait relayé à un client qui ne l'a pas demandé
+        upstream_headers = {'Accept-Encoding': request.headers.get('Accept-Encoding', 'identity')}
+        response = requests.get(f"{SERVICE_C_URL}/data", headers=upstream_headers, timeout=3, stream=True)
+        headers = {name: response.headers[name] for name in PASSTHROUGH_HEADERS if name in response.headers}
+
+        def relay():
+            try:
+                # decode_content=False : le corps compressé reste compressé
+                for chunk in response.raw.stream(64 * 1024, decode_content=False):
+                    yield chunk
+            finally:
+                response.close()
+
+        return Response(relay(), status=response.status_code, headers=headers, direct_passthrough=True)
     except requests.exceptions.Timeout:
         return jsonify({"error": "Service timeout"}), 504
     except Exception as e:
@@ -56,5 +78,91 @@ def readiness_check():
     except:
         return jsonify({"status": "not ready", "reason": "dependency unreachable"}), 503
 
+# --- Profilage à la demande : /debug/profile et /debug/slow ---
+# Protégés par X-Debug-Token si DEBUG_TOKEN est défini, sinon accessibles en local uniquement
+DEBUG_TOKEN = os.environ.get("DEBUG_TOKEN", "")
+LOOPBACK_ADDRESSES = {"127.0.0.1", "::1"}
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", 30))
+PROFILE_INTERVAL = 0.005
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", 500))
+
+profile_lock = Lock()
+slow_requests = deque(maxlen=int(os.environ.get("SLOW_REQUEST_BUFFER", 50)))
+slow_requests_lock = Lock()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_slow_request(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        duration_ms = (time.perf_counter() - started) * 1000
+        if duration_ms >= SLOW_REQUEST_MS:
+            with slow_requests_lock:
+                slow_requests.append({
+                    "method": request.method,
+                    "path": request.path,
+                    "status": response.status_code,
+                    "duration_ms": round(duration_ms, 2),
+                    "timestamp": time.time()
+                })
+    return response
+
+def debug_allowed():
+    """Jeton X-Debug-Token si DEBUG_TOKEN est défini, sinon requêtes locales uniquement"""
+    if DEBUG_TOKEN:
+        return hmac.compare_digest(request.headers.get("X-Debug-Token", ""), DEBUG_TOKEN)
+    return request.remote_addr in LOOPBACK_ADDRESSES
+
+def collapse_stack(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+@app.route('/debug/profile')
+def debug_profile():
+    """Profil par échantillonnage de tous les threads, au format "piles repliées" """
+    if not debug_allowed():
+        return jsonify({"error": "Forbidden"}), 403
+    try:
+        seconds = float(request.args.get("seconds", 5))
+    except ValueError:
+        return jsonify({"error": "seconds must be a number"}), 400
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        return jsonify({"error": f"seconds must be between 0 and {PROFILE_MAX_SECONDS:g}"}), 400
+    if not profile_lock.acquire(blocking=False):
+        return jsonify({"error": "A profile is already running"}), 409
+    try:
+        samples = Counter()
+        current = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != current:
+                    samples[collapse_stack(frame)] += 1
+            time.sleep(PROFILE_INTERVAL)
+    finally:
+        profile_lock.release()
+    body = "\n".join(f"{stack} {count}" for stack, count in samples.most_common()) + "\n"
+    return body, 200, {"Content-Type": "text/plain; charset=utf-8"}
+
+@app.route('/debug/slow')
+def debug_slow():
+    """Requêtes récentes les plus lentes"""
+    if not debug_allowed():
+        return jsonify({"error": "Forbidden"}), 403
+    limit = request.args.get("limit", type=int)
+    with slow_requests_lock:
+        entries = sorted(slow_requests, key=lambda entry: entry["duration_ms"], reverse=True)
+    return jsonify({
+        "threshold_ms": SLOW_REQUEST_MS,
+        "requests": entries[:limit] if limit else entries
+    })
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
@@ -1,22 +1,240 @@
-from flask import Flask, jsonify
+from flask import Flask, g, jsonify, request
+import hmac
+import os
 import random
+import sys
+import threading
 import time
+from collections import Counter, deque
+from threading import Event, Lock
 
 app = Flask(__name__)
 
 # Simulation d'une base de données
 database_status = {"healthy": True, "records": 1000}
 
+
+def parse_schedule(value):
+    """Parse un planning de pannes "debut:duree:taux,..." (secondes, taux entre 0 et 1)"""
+    schedule = []
+    for chunk in (value or "").split(","):
+        chunk = chunk.strip()
+        if not chunk:
+            continue
+        start, duration, rate = chunk.split(":")
+        schedule.append({
+            "start": float(start),
+            "duration": float(duration),
+            "error_rate": float(rate)
+        })
+    return validate_schedule(schedule)
+
+
+def validate_schedule(schedule):
+    """Vérifie un planning de pannes et le normalise (liste de fenêtres numériques)"""
+    if not isinstance(schedule, list):
+        raise ValueError('schedule must be a list or a "start:duration:rate,..." string')
+    windows = []
+    for window in schedule:
+        if not isinstance(window, dict) or set(window) != {"start", "duration", "error_rate"}:
+            raise ValueError("schedule entries must have exactly start, duration and error_rate")
+        start, duration, rate = (float(window[key]) for key in ("start", "duration", "error_rate"))
+        if start < 0 or duration < 0:
+            raise ValueError("schedule start and duration must not be negative")
+        if not 0 <= rate <= 1:
+            raise ValueError("schedule error_rate must be between 0 and 1")
+        windows.append({"start": start, "duration": duration, "error_rate": rate})
+    return windows
+
+
+def validate_latency_params(params):
+    """Vérifie les paramètres de latence (clés connues, nombres positifs)"""
+    if not isinstance(params, dict):
+        raise ValueError("latency_params must be an object")
+    unknown = set(params) - set(FaultSimulator.LATENCY_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown latency_params: {', '.join(sorted(unknown))}")
+    validated = {}
+    for key, value in params.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            raise ValueError(f"latency_params.{key} must be a positive number")
+        validated[key] = float(value)
+    if validated.get("alpha") == 0:
+        raise ValueError("latency_params.alpha must be greater than 0")
+    return validated
+
+
+class FaultSimulator:
+    """Simulateur de pannes et de latence reproductible et pilotable à chaud"""
+
+    LATENCY_MODES = ("none", "fixed", "uniform", "normal", "pareto")
+    LATENCY_PARAMS = ("value", "min", "max", "mean", "stddev", "scale", "alpha")
+
+    def __init__(self, seed=None, latency_mode="uniform", latency_params=None,
+                 error_rate=0.1, health_failure_rate=0.2, schedule=None,
+                 payload_items=2, payload_padding=0):
+        self.lock = Lock()
+        # Réveillé par /control/reset pour libérer les requêtes en attente
+        self.interrupt = Event()
+        self.configure(
+            seed=seed,
+            latency_mode=latency_mode,
+            latency_params=latency_params or {"min": 0.1, "max": 0.5},
+            error_rate=error_rate,
+            health_failure_rate=health_failure_rate,
+            schedule=schedule or [],
+            payload_items=payload_items,
+            payload_padding=payload_padding
+        )
+        self.reset()
+
+    def configure(self, **settings):
+        """Met à jour la configuration (seules les clés fournies sont modifiées).
+
+        Tout est validé avant d'appliquer quoi que ce soit : une valeur invalide
+        lève ValueError et laisse le simulateur inchangé.
+        """
+        updates = {}
+        if settings.get("latency_mode") is not None:
+            if settings["latency_mode"] not in self.LATENCY_MODES:
+                raise ValueError(f"latency_mode must be one of {', '.join(self.LATENCY_MODES)}")
+            updates["latency_mode"] = settings["latency_mode"]
+        if settings.get("latency_params") is not None:
+            updates["latency_params"] = validate_latency_params(settings["latency_params"])
+        for key in ("error_rate", "health_failure_rate"):
+            if settings.get(key) is not None:
+                rate = float(settings[key])
+                if not 0 <= rate <= 1:
+                    raise ValueError(f"{key} must be between 0 and 1")
+                updates[key] = rate
+        if settings.get("schedule") is not None:
+            schedule = settings["schedule"]
+            updates["schedule"] = parse_schedule(schedule) if isinstance(schedule, str) else validate_schedule(schedule)
+        for key in ("payload_items", "payload_padding"):
+            if settings.get(key) is not None:
+                updates[key] = max(0, int(settings[key]))
+        if "seed" in settings:
+            seed = settings["seed"]
+            if seed is not None and (isinstance(seed, bool) or not isinstance(seed, int)):
+                raise ValueError("seed must be an integer or null")
+            updates["seed"] = seed
+        with self.lock:
+            for key, value in updates.items():
+                setattr(self, key, value)
+
+    def reset(self):
+        """Redémarre l'horloge du planning et les compteurs de tirages"""
+        with self.lock:
+            self.draws = {}
+            self.started_at = time.monotonic()
+            self.interrupt.set()
+            self.interrupt = Event()
+
+    def request_rng(self, stream):
+        """Générateur du n-ième tirage d'un flux ("health", "data").
+
+        Chaque tirage est dérivé de (graine, flux, rang) : les sondes de santé ne
+        décalent pas les tirages de /data, et la n-ième requête /data d'un
+        scénario rejoué reçoit toujours le même sort, quel que soit l'entrelacement.
+        """
+        with self.lock:
+            index = self.draws.get(stream, 0)
+            self.draws[stream] = index + 1
+            seed = self.seed
+        if seed is None:
+            return random.Random()
+        return random.Random(f"{seed}:{stream}:{index}")
+
+    def elapsed(self):
+        return time.monotonic() - self.started_at
+
+    def current_error_rate(self):
+        """Taux d'erreur actif : le planning est prioritaire sur le taux de base"""
+        elapsed = self.elapsed()
+        for window in self.schedule:
+            if window["start"] <= elapsed < window["start"] + window["duration"]:
+                return window["error_rate"]
+        return self.error_rate
+
+    def sample_latency(self, rng):
+        """Tire une latence (en secondes) selon la distribution configurée"""
+        with self.lock:
+            mode, params = self.latency_mode, self.latency_params
+        if mode == "none":
+            return 0.0
+        if mode == "fixed":
+            return float(params.get("value", 0.1))
+        if mode == "uniform":
+            return rng.uniform(params.get("min", 0.1), params.get("max", 0.5))
+        if mode == "normal":
+            return max(0.0, rng.gauss(params.get("mean", 0.2), params.get("stddev", 0.05)))
+        # pareto : longue traîne, "scale" est la latence minimale
+        latency = params.get("scale", 0.05) * rng.paretovariate(params.get("alpha", 1.5))
+        return min(latency, params.get("max", 10.0))
+
+    def wait(self, seconds):
+        """Attente interruptible : un reset libère immédiatement les requêtes en cours"""
+        if seconds > 0:
+            self.interrupt.wait(seconds)
+
+    def payload(self):
+        padding = "x" * self.payload_padding
+        data = []
+        for i in range(1, self.payload_items + 1):
+            item = {"id": i, "name": f"Item {i}"}
+            if padding:
+                item["padding"] = padding
+            data.append(item)
+        return data
+
+    def snapshot(self):
+        return {
+            "seed": self.seed,
+            "latency_mode": self.latency_mode,
+            "latency_params": self.latency_params,
+            "error_rate": self.error_rate,
+            "current_error_rate": self.current_error_rate(),
+            "health_failure_rate": self.health_failure_rate,
+            "schedule": self.schedule,
+            "payload_items": self.payload_items,
+            "payload_padding": self.payload_padding,
+            "elapsed": round(self.elapsed(), 3)
+        }
+
+
+def simulator_from_env():
+    """Construit le simulateur depuis les variables d'environnement SIM_*"""
+    seed = os.environ.get("SIM_SEED")
+    latency_params = {}
+    for key in ("value", "min", "max", "mean", "stddev", "scale", "alpha"):
+        env_value = os.environ.get(f"SIM_LATENCY_{key.upper()}")
+        if env_value is not None:
+            latency_params[key] = float(env_value)
+    return FaultSimulator(
+        seed=int(seed) if seed is not None else None,
+        latency_mode=os.environ.get("SIM_LATENCY_MODE", "uniform"),
+        latency_params=latency_params or None,
+        error_rate=float(os.environ.get("SIM_ERROR_RATE", 0.1)),
+        health_failure_rate=float(os.environ.get("SIM_HEALTH_FAILURE_RATE", 0.2)),
+        schedule=parse_schedule(os.environ.get("SIM_SCHEDULE", "")),
+        payload_items=int(os.environ.get("SIM_PAYLOAD_ITEMS", 2)),
+        payload_padding=int(os.environ.get("SIM_PAYLOAD_PADDING", 0))
+    )
+
+
+simulator = simulator_from_env()
+
+
 @app.route('/health')
 def health_check():
     """Health check endpoint"""
-    # Simuler des pannes aléatoirement
-    if random.random() < 0.2:  # 20% de chance de panne
+    # Simuler des pannes selon le taux configuré
+    if simulator.request_rng("health").random() < simulator.health_failure_rate:
         return jsonify({
             "status": "unhealthy",
             "message": "Database connection failed"
         }), 503
-    
+
     return jsonify({
         "status": "healthy",
         "database": "connected",
@@ -26,19 +244,128 @@ def health_check():
 @app.route('/data')
 def get_data():
     """Endpoint de données"""
-    if random.random() < 0.1:  # 10% de chance d'erreur
+    # Échec et latence tirés d'un générateur propre à cette requête
+    rng = simulator.request_rng("data")
+    if rng.random() < simulator.current_error_rate():
         return jsonify({"error": "Database error"}), 500
-    
+
     # Simuler une latence
-    time.sleep(random.uniform(0.1, 0.5))
-    
+    simulator.wait(simulator.sample_latency(rng))
+
     return jsonify({
-        "data": [
-            {"id": 1, "name": "Item 1"},
-            {"id": 2, "name": "Item 2"}
-        ],
+        "data": simulator.payload(),
         "timestamp": int(time.time())
     })
 
+@app.route('/control', methods=['GET'])
+def get_control():
+    """État courant du simulateur"""
+    return jsonify(simulator.snapshot())
+
+@app.route('/control', methods=['POST'])
+def update_control():
+    """Modifier le simulateur à chaud (latence, taux d'erreur, planning, payload)"""
+    settings = request.get_json(silent=True) or {}
+    try:
+        simulator.configure(**settings)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    if settings.get("reset") or "seed" in settings:
+        simulator.reset()
+    return jsonify(simulator.snapshot())
+
+@app.route('/control/reset', methods=['POST'])
+def reset_control():
+    """Rejouer le scénario depuis t=0 avec la même graine"""
+    simulator.reset()
+    return jsonify(simulator.snapshot())
+
+# --- Profilage à la demande : /debug/profile et /debug/slow ---
+# Protégés par X-Debug-Token si DEBUG_TOKEN est défini, sinon accessibles en local uniquement
+DEBUG_TOKEN = os.environ.get("DEBUG_TOKEN", "")
+LOOPBACK_ADDRESSES = {"127.0.0.1", "::1"}
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", 30))
+PROFILE_INTERVAL = 0.005
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", 500))
+
+profile_lock = Lock()
+slow_requests = deque(maxlen=int(os.environ.get("SLOW_REQUEST_BUFFER", 50)))
+slow_requests_lock = Lock()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_slow_request(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        duration_ms = (time.perf_counter() - started) * 1000
+        if duration_ms >= SLOW_REQUEST_MS:
+            with slow_requests_lock:
+                slow_requests.append({
+                    "method": request.method,
+                    "path": request.path,
+                    "status": response.status_code,
+                    "duration_ms": round(duration_ms, 2),
+                    "timestamp": time.time()
+                })
+    return response
+
+def debug_allowed():
+    """Jeton X-Debug-Token si DEBUG_TOKEN est défini, sinon requêtes locales uniquement"""
+    if DEBUG_TOKEN:
+        return hmac.compare_digest(request.headers.get("X-Debug-Token", ""), DEBUG_TOKEN)
+    return request.remote_addr in LOOPBACK_ADDRESSES
+
+def collapse_stack(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+@app.route('/debug/profile')
+def debug_profile():
+    """Profil par échantillonnage de tous les threads, au format "piles repliées" """
+    if not debug_allowed():
+        return jsonify({"error": "Forbidden"}), 403
+    try:
+        seconds = float(request.args.get("seconds", 5))
+    except ValueError:
+        return jsonify({"error": "seconds must be a number"}), 400
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        return jsonify({"error": f"seconds must be between 0 and {PROFILE_MAX_SECONDS:g}"}), 400
+    if not profile_lock.acquire(blocking=False):
+        return jsonify({"error": "A profile is already running"}), 409
+    try:
+        samples = Counter()
+        current = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != current:
+                    samples[collapse_stack(frame)] += 1
+            time.sleep(PROFILE_INTERVAL)
+    finally:
+        profile_lock.release()
+    body = "\n".join(f"{stack} {count}" for stack, count in samples.most_common()) + "\n"
+    return body, 200, {"Content-Type": "text/plain; charset=utf-8"}
+
+@app.route('/debug/slow')
+def debug_slow():
+    """Requêtes récentes les plus lentes"""
+    if not debug_allowed():
+        return jsonify({"error": "Forbidden"}), 403
+    limit = request.args.get("limit", type=int)
+    with slow_requests_lock:
+        entries = sorted(slow_requests, key=lambda entry: entry["duration_ms"], reverse=True)
+    return jsonify({
+        "threshold_ms": SLOW_REQUEST_MS,
+        "requests": entries[:limit] if limit else entries
+    })
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # Serveur multi-thread : une requête en attente n'en bloque pas une autre
+    app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)